@@ -0,0 +1,100 @@
+import math
+import difflib
+from collections import Counter
+
+# Song fields a guess is compared against, aliases are handled separately
+ANSWER_FIELDS = ("title", "reading", "romonizedTitle", "fullRomonizedTitle")
+
+# Candidates shorter than this are ignored
+MIN_ANSWER_LENGTH = 3
+
+
+def get_threshold(length):
+    if length < 5:
+        return 0.6
+    elif length > 30:
+        return 0.45
+    return 0.2 * math.exp(-0.1 * (length - 5)) + 0.45
+
+
+class AnswerCandidate:
+    """
+    A single accepted answer for a song, normalized and ready to be matched.
+    """
+
+    __slots__ = (
+        "text",
+        "threshold",
+        "char_counts",
+        "min_length",
+        "max_length",
+        "matcher",
+    )
+
+    def __init__(self, text, threshold):
+        self.text = text
+        self.threshold = threshold
+        self.char_counts = Counter(text)
+
+        # SequenceMatcher ratio is 2 * matches / (len(a) + len(b)) and matches can't
+        # exceed the shorter string, so guesses outside these lengths can never pass.
+        # The bounds are rounded outwards so they only ever skip hopeless guesses.
+        length = len(text)
+        self.min_length = math.floor(threshold * length / (2 - threshold))
+        self.max_length = math.ceil(length * (2 - threshold) / threshold)
+
+        # SequenceMatcher caches its analysis of the second sequence, so keep one per
+        # candidate and only swap the guess in
+        self.matcher = difflib.SequenceMatcher(None, "", text)
+
+    def matches(self, guess, guess_counts):
+        guess_length = len(guess)
+        if guess_length < self.min_length or guess_length > self.max_length:
+            return False
+
+        # The shared character count is an upper bound of the matching characters
+        overlap = 0
+        for char, count in self.char_counts.items():
+            overlap += min(count, guess_counts[char])
+        if 2.0 * overlap / (guess_length + len(self.text)) <= self.threshold:
+            return False
+
+        self.matcher.set_seq1(guess)
+        return self.matcher.ratio() > self.threshold
+
+
+class AnswerMatcher:
+    """
+    Precompiled answers of a song, built once when the song data is loaded.
+
+    :param item: The Song to match guesses against.
+    """
+
+    def __init__(self, item):
+        thresholds = {}
+
+        values = [getattr(item, field_name) for field_name in ANSWER_FIELDS]
+        values.extend(item.aliases or [])
+
+        for value in values:
+            if not isinstance(value, str) or len(value) < MIN_ANSWER_LENGTH:
+                continue
+
+            # Several fields often hold the same text, only keep the most lenient one
+            text = value.lower()
+            threshold = get_threshold(len(value))
+            thresholds[text] = min(threshold, thresholds.get(text, threshold))
+
+        self.candidates = [
+            AnswerCandidate(text, threshold) for text, threshold in thresholds.items()
+        ]
+
+    def is_correct(self, guess):
+        guess = guess.lower()
+        guess_counts = Counter(guess)
+
+        for candidate in self.candidates:
+            if candidate.matches(guess, guess_counts):
+                return True
+
+        return False
@@ -0,0 +1,29 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode="w", encoding=None):
+    """
+    Write a file so that readers only ever see the old or the complete new file.
+
+    The data goes to a temporary file next to path, which replaces path once the
+    block finishes. If the block raises, the temporary file is removed and path is
+    left as it was.
+
+    :param path: The file to write.
+    :param mode: "w" or "wb", like for open.
+    :param encoding: The encoding of text files.
+    :return: The open temporary file.
+    """
+    temp_path = path + ".part"
+    try:
+        with open(temp_path, mode, encoding=encoding) as file:
+            yield file
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,66 @@
+"""
+Compare load time and memory of the JSON song data and the compact catalog.
+
+Run from the repository root after generating the song data:
+
+    python -m benchmarks.catalog_load [--repeat 20]
+"""
+
+import argparse
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from song_catalog import load_catalog, song_catalog_file, song_data_file
+
+
+def load_json():
+    # How the bot used to load the songs
+    with open(song_data_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_compact():
+    return load_catalog(song_data_file, song_catalog_file)
+
+
+LOADERS = {
+    "json": load_json,
+    "compact": load_compact,
+}
+
+
+def measure(loader, repeat):
+    """
+    :return: (median_ms, retained_bytes, peak_bytes)
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        loader()
+        times.append((time.perf_counter() - start) * 1000)
+
+    gc.collect()
+    tracemalloc.start()
+    songs = loader()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del songs
+
+    return statistics.median(times), retained, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'loader':<10}{'median ms':>12}{'retained MiB':>15}{'peak MiB':>12}")
+    for name, loader in LOADERS.items():
+        median, retained, peak = measure(loader, args.repeat)
+        print(
+            f"{name:<10}{median:>12.2f}{retained / 1024 / 1024:>15.2f}"
+            f"{peak / 1024 / 1024:>12.2f}"
+        )
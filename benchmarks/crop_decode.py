@@ -0,0 +1,89 @@
+"""
+Compare the CPU time and decoded pixels of guess game crops with and without CROP_MAX_SIZE.
+
+Run from the repository root after downloading the covers:
+
+    python -m benchmarks.crop_decode [--images images] [--max-size 256] [--limit 200]
+
+Without an images folder the covers are generated, see --size.
+"""
+
+import argparse
+import math
+import os
+import random
+import statistics
+import tempfile
+import time
+from PIL import Image
+import guess_image
+from benchmarks import fixtures
+
+
+def get_decoded_bytes(path, max_size, fraction):
+    # The pixels decoded for one crop, the draft decides how much of the image is decoded
+    with Image.open(path) as img:
+        width, height = img.size
+        square_size = int(min(width, height) * fraction)
+        if max_size and square_size > max_size:
+            scale = max_size / square_size
+            img.draft(img.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+        return img.size[0] * img.size[1] * len(img.getbands())
+
+
+def run(paths, max_size, fraction, repeat):
+    print(
+        f"{'decode':<12}{'median ms':>12}{'p95 ms':>10}{'cpu ms':>10}"
+        f"{'decoded MiB':>14}{'mean KiB':>10}"
+    )
+
+    for name, cap in (("full", 0), (f"cap {max_size}", max_size)):
+        guess_image.crop_max_size = cap
+        random.seed(0)
+        times = []
+        sizes = []
+
+        cpu_start = time.process_time()
+        for _ in range(repeat):
+            for path in paths:
+                start = time.perf_counter()
+                image_bytes, _ = guess_image.get_random_square_fraction(path, fraction)
+                times.append((time.perf_counter() - start) * 1000)
+                sizes.append(image_bytes.getbuffer().nbytes)
+        cpu_ms = (time.process_time() - cpu_start) * 1000 / len(times)
+
+        decoded = statistics.mean(get_decoded_bytes(p, cap, fraction) for p in paths)
+
+        times.sort()
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(
+            f"{name:<12}{statistics.median(times):>12.2f}{p95:>10.2f}{cpu_ms:>10.2f}"
+            f"{decoded / 1024 / 1024:>14.2f}{statistics.mean(sizes) / 1024:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", default="images")
+    parser.add_argument("--max-size", type=int, default=256)
+    parser.add_argument("--fraction", type=float, default=guess_image.crop_fraction)
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--size", type=int, default=1024, help="side of the generated covers"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        if os.path.isdir(args.images):
+            paths = [
+                os.path.join(args.images, filename)
+                for filename in sorted(os.listdir(args.images))[: args.limit]
+            ]
+        else:
+            print(f"'{args.images}' not found, using generated covers")
+            songs = fixtures.make_songs(min(args.limit, 50))
+            covers = fixtures.write_covers(songs, folder, (args.size, args.size))
+            paths = [path for _, path in covers]
+
+        run(paths, args.max_size, args.fraction, args.repeat)
@@ -0,0 +1,92 @@
+"""
+Compare encode time and attachment size of guess game crops per format.
+
+Run from the repository root after downloading the covers:
+
+    python -m benchmarks.crop_encoding [--fraction 0.4] [--limit 200]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+from io import BytesIO
+from PIL import Image
+from guess_image import crop_fraction, encode_image, get_crop_format
+
+
+def encode_baseline(image):
+    # The encoding used before crops picked their format per source
+    img_byte_arr = BytesIO()
+    image.save(img_byte_arr, format="PNG")
+    img_byte_arr.seek(0)
+    return img_byte_arr, ".png"
+
+
+ENCODERS = {
+    "png (default)": encode_baseline,
+    "png (fast)": lambda image: encode_image(image, "PNG"),
+    "jpeg": lambda image: encode_image(image, "JPEG"),
+    "webp": lambda image: encode_image(image, "WEBP"),
+    "auto": None,
+}
+
+
+def load_crops(images_folder, fraction, limit):
+    """
+    Crop a random square from every cover, seeded so runs are comparable.
+
+    :return: A list of (source_image, cropped_image).
+    """
+    rng = random.Random(0)
+    crops = []
+
+    for filename in sorted(os.listdir(images_folder))[:limit]:
+        with Image.open(os.path.join(images_folder, filename)) as img:
+            img.load()
+            img_width, img_height = img.size
+            square_size = int(min(img_width, img_height) * fraction)
+            x = rng.randint(0, img_width - square_size)
+            y = rng.randint(0, img_height - square_size)
+            crops.append((img, img.crop((x, y, x + square_size, y + square_size))))
+
+    return crops
+
+
+def run(crops):
+    print(
+        f"{'format':<16}{'median ms':>12}{'p95 ms':>10}{'mean KiB':>12}{'total MiB':>12}"
+    )
+
+    for name, encoder in ENCODERS.items():
+        times = []
+        sizes = []
+
+        for source, crop in crops:
+            start = time.perf_counter()
+            if encoder is None:
+                image_bytes, _ = encode_image(crop, get_crop_format(source))
+            else:
+                image_bytes, _ = encoder(crop)
+            times.append((time.perf_counter() - start) * 1000)
+            sizes.append(image_bytes.getbuffer().nbytes)
+
+        times.sort()
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(
+            f"{name:<16}{statistics.median(times):>12.2f}{p95:>10.2f}"
+            f"{statistics.mean(sizes) / 1024:>12.1f}{sum(sizes) / 1024 / 1024:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", default="images")
+    parser.add_argument("--fraction", type=float, default=crop_fraction)
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    crops = load_crops(args.images, args.fraction, args.limit)
+    print(f"Encoding {len(crops)} crops from {args.images}/\n")
+    run(crops)
@@ -0,0 +1,167 @@
+"""
+Reproducible fixtures for the benchmarks, generated from a fixed seed.
+"""
+
+import json
+import os
+import random
+from io import BytesIO
+from PIL import Image, ImageChops
+
+WORDS = [
+    "Blue",
+    "Night",
+    "Sky",
+    "Dream",
+    "Fire",
+    "Heart",
+    "Star",
+    "Genesis",
+    "Paradise",
+    "Crown",
+    "Glorious",
+    "Destiny",
+    "ワールド",
+    "エンド",
+    "カタカナ",
+    "ソード",
+    "ニコニコ",
+    "ハート",
+]
+
+CHAT_MESSAGES = [
+    "lol",
+    "no idea",
+    "what is this",
+    "is it the one from the new version?",
+    "gg",
+    "i know this one",
+    "skip",
+    "???",
+    "help",
+    "this is so hard",
+    "wait",
+    "maybe",
+]
+
+
+def make_songs(count, seed=0):
+    """
+    Make song data shaped like full_song_data.json.
+    """
+    rng = random.Random(seed)
+    songs = []
+
+    for i in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        songs.append(
+            {
+                "songId": f"song{i}",
+                "category": "POPS & ANIME",
+                "artist": f"Artist {i % 50}",
+                "title": title,
+                "reading": title.upper() if i % 3 == 0 else None,
+                "romonizedTitle": title,
+                "fullRomonizedTitle": title.lower(),
+                "aliases": [title.split(" ")[0] + str(i)] if i % 2 else [],
+                "bpm": 120 + i % 100,
+                "imageName": f"{i:08x}.jpg",
+                "version": "Benchmark",
+                "releaseDate": "2024-01-01",
+                "isNew": False,
+                "isLocked": False,
+                "comment": None,
+                "sheets": [{"type": "std", "difficulty": "master", "level": "13"}] * 5,
+            }
+        )
+
+    return songs
+
+
+def mutate(text, rng, edits):
+    # Apply a few random character edits, like a typo'd guess
+    chars = list(text)
+    for _ in range(edits):
+        position = rng.randrange(len(chars) + 1)
+        operation = rng.random()
+        if operation < 0.33 and chars:
+            chars.pop(min(position, len(chars) - 1))
+        elif operation < 0.66:
+            chars.insert(position, rng.choice("abcdefghijklmnopqrstuvwxyz "))
+        elif chars:
+            chars[min(position, len(chars) - 1)] = rng.choice("aeiou")
+    return "".join(chars)
+
+
+def make_guesses(songs, count, seed=0):
+    """
+    Make guess corpora against random songs.
+
+    :return: A dict of corpus name to a list of (song, guess).
+    """
+    rng = random.Random(seed)
+    corpora = {"correct": [], "near-miss": [], "noise": []}
+
+    for _ in range(count):
+        song = rng.choice(songs)
+        answers = [song["title"], song["fullRomonizedTitle"], *song["aliases"]]
+        answer = rng.choice(answers)
+
+        corpora["correct"].append((song, rng.choice([answer, answer.lower()])))
+        corpora["near-miss"].append(
+            (song, mutate(rng.choice(songs)["title"], rng, rng.randint(1, 3)))
+        )
+        corpora["noise"].append((song, rng.choice(CHAT_MESSAGES)))
+
+    return corpora
+
+
+def make_image(size, seed=0, mode="RGB"):
+    """
+    Make a deterministic image with both smooth and detailed areas, like artwork.
+    """
+    rng = random.Random(seed)
+    x = rng.uniform(-2.0, -1.0)
+    y = rng.uniform(-1.2, 0.0)
+    fractal = Image.effect_mandelbrot(size, (x, y, x + 1.5, y + 1.2), 64)
+    gradient = Image.linear_gradient("L").resize(size)
+    image = Image.merge("RGB", (fractal, gradient, ImageChops.invert(fractal))).convert(
+        mode
+    )
+
+    if mode == "RGBA":
+        image.putalpha(gradient)
+
+    return image
+
+
+def encode(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def write_covers(songs, folder, size=(512, 512), seed=0):
+    """
+    Write a cover for every song, every tenth one as a PNG with transparency.
+
+    :return: A list of (song, cover_path).
+    """
+    os.makedirs(folder, exist_ok=True)
+    covers = []
+
+    for i, song in enumerate(songs):
+        if i % 10 == 0:
+            path = os.path.join(folder, f"{song['songId']}.png")
+            make_image(size, seed + i, "RGBA").save(path)
+        else:
+            path = os.path.join(folder, f"{song['songId']}.jpg")
+            make_image(size, seed + i).save(path, quality=90)
+        covers.append((song, path))
+
+    return covers
+
+
+def write_songs(songs, path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(songs, file, ensure_ascii=False, indent=2)
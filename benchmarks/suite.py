@@ -0,0 +1,270 @@
+"""
+Benchmark the hot paths of the bot on reproducible fixtures, no Discord connection needed.
+
+Run from the repository root:
+
+    python -m benchmarks.suite [--output results.json] [--compare previous.json]
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import PIL
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the resident memory peaks are skipped there
+    resource = None
+
+from benchmarks import fixtures
+from answer_matcher import AnswerMatcher
+from song_catalog import Song, load_catalog, write_catalog
+from guess_image import crop_fraction, get_random_square_fraction
+from image_handler import create_image, template_registry
+
+USER_IMAGE_SIZES = [(320, 240), (1280, 960), (3000, 2000)]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[
+        min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    ]
+
+
+def summarize(times, peak_bytes, rss_peak_bytes=None, **extra):
+    """
+    :param times: Durations of the single operations in seconds.
+    :param peak_bytes: The Python heap peak from measure_peak.
+    :param rss_peak_bytes: The resident memory peak from measure_rss_peak, if measured.
+    :return: A dict of the statistics, times in milliseconds.
+    """
+    times = sorted(times)
+    result = {
+        "count": len(times),
+        "p50_ms": percentile(times, 0.5) * 1000,
+        "p95_ms": percentile(times, 0.95) * 1000,
+        "p99_ms": percentile(times, 0.99) * 1000,
+        "mean_ms": statistics.mean(times) * 1000,
+        "ops_per_sec": len(times) / sum(times) if sum(times) > 0 else 0,
+        "peak_mib": peak_bytes / 1024 / 1024,
+        "rss_peak_mib": (
+            rss_peak_bytes / 1024 / 1024 if rss_peak_bytes is not None else None
+        ),
+    }
+    result.update(extra)
+    return result
+
+
+def measure_peak(func):
+    # tracemalloc slows everything down, so the peak is measured in a separate run.
+    # It only sees the Python heap, not the pixel buffers Pillow allocates in C
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure_rss_peak(func, *args):
+    """
+    Run func(*args) once in a fresh process and measure its resident memory.
+
+    Unlike measure_peak this includes the pixel buffers of Pillow. The call starts
+    with empty caches, so it includes decoding the base images.
+
+    :return: How many bytes the call raised the resident memory peak of the process
+        by, or None where it can't be measured.
+    """
+    if resource is None or "forkserver" not in multiprocessing.get_all_start_methods():
+        return None
+
+    # A child of this process would inherit the peak of the benchmarks that ran
+    # before, children of the fork server start from its small footprint
+    context = multiprocessing.get_context("forkserver")
+    with context.Pool(1) as pool:
+        return pool.apply(get_rss_increase, (func, *args))
+
+
+def get_rss_increase(func, *args):
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    func(*args)
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * scale
+
+
+def time_calls(func, args_list):
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_guesses(songs, guess_count):
+    matchers = {song["songId"]: AnswerMatcher(Song.from_dict(song)) for song in songs}
+    corpora = fixtures.make_guesses(songs, guess_count)
+    results = {}
+
+    def is_correct_guess(song, guess):
+        return matchers[song["songId"]].is_correct(guess)
+
+    for name, guesses in corpora.items():
+        times = time_calls(is_correct_guess, guesses)
+        accepted = sum(is_correct_guess(song, guess) for song, guess in guesses)
+        peak = measure_peak(lambda: time_calls(is_correct_guess, guesses))
+        results[f"is_correct_guess[{name}]"] = summarize(
+            times, peak, accepted=accepted / len(guesses)
+        )
+
+    return results
+
+
+def bench_create_image(repeat):
+    results = {}
+
+    for template in template_registry.templates:
+        for size in USER_IMAGE_SIZES:
+            user_image = fixtures.encode(fixtures.make_image(size), "JPEG", quality=90)
+            args = (
+                template.is_base_bg,
+                template.path,
+                user_image,
+                template.position,
+                template.size,
+                template.version,
+            )
+
+            # The first call fills the base image cache
+            start = time.perf_counter()
+            output_bytes = len(create_image(*args).getvalue())
+            cold_ms = (time.perf_counter() - start) * 1000
+
+            times = time_calls(create_image, [args] * repeat)
+            peak = measure_peak(lambda: create_image(*args))
+            rss_peak = measure_rss_peak(create_image, *args)
+            mode = "base_bg" if template.is_base_bg else "overlay"
+            results[f"create_image[{mode},{size[0]}x{size[1]}]"] = summarize(
+                times, peak, rss_peak, cold_ms=cold_ms, output_bytes=output_bytes
+            )
+
+    return results
+
+
+def bench_crops(covers, repeat):
+    random.seed(0)
+    paths = [random.choice(covers)[1] for _ in range(repeat)]
+    sizes = []
+
+    def crop(path):
+        image_bytes, _ = get_random_square_fraction(path, crop_fraction)
+        sizes.append(image_bytes.getbuffer().nbytes)
+
+    times = time_calls(crop, [(path,) for path in paths])
+    peak = measure_peak(lambda: crop(paths[0]))
+    rss_peak = measure_rss_peak(get_random_square_fraction, paths[0], crop_fraction)
+    return {
+        "get_random_square_fraction": summarize(
+            times, peak, rss_peak, mean_output_bytes=statistics.mean(sizes)
+        )
+    }
+
+
+def bench_catalog(songs, folder, repeat):
+    data_path = os.path.join(folder, "full_song_data.json")
+    catalog_path = os.path.join(folder, "song_catalog.pickle")
+    fixtures.write_songs(songs, data_path)
+    write_catalog(songs, catalog_path)
+
+    def load_json():
+        with open(data_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_compact():
+        return load_catalog(data_path, catalog_path)
+
+    results = {}
+    for name, loader in (("json", load_json), ("compact", load_compact)):
+        times = time_calls(loader, [()] * repeat)
+        results[f"catalog_load[{name}]"] = summarize(times, measure_peak(loader))
+
+    return results
+
+
+def print_results(results, previous=None):
+    print(
+        f"{'benchmark':<40}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'ops/s':>12}{'heap MiB':>10}{'RSS MiB':>10}"
+    )
+    for name, result in results.items():
+        # Results written before the resident memory was measured don't have it
+        rss_peak = result.get("rss_peak_mib")
+        line = (
+            f"{name:<40}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}"
+            f"{result['p99_ms']:>10.3f}{result['ops_per_sec']:>12.1f}"
+            f"{result['peak_mib']:>10.2f}"
+            + (f"{rss_peak:>10.2f}" if rss_peak is not None else f"{'-':>10}")
+        )
+        if previous is not None and name in previous:
+            line += f"  p50 x{result['p50_ms'] / previous[name]['p50_ms']:.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--songs", type=int, default=1500)
+    parser.add_argument("--guesses", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+    args = parser.parse_args()
+
+    songs = fixtures.make_songs(args.songs)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        covers = fixtures.write_covers(songs[:50], os.path.join(folder, "images"))
+
+        results.update(bench_guesses(songs, args.guesses))
+        results.update(bench_create_image(args.repeat))
+        results.update(bench_crops(covers, args.repeat * 10))
+        results.update(bench_catalog(songs, folder, args.repeat))
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            previous = json.load(file)["results"]
+
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "meta": {
+                        "time": datetime.now().isoformat(timespec="seconds"),
+                        "python": platform.python_version(),
+                        "pillow": PIL.__version__,
+                        "machine": platform.machine(),
+                        "args": vars(args),
+                    },
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+        print(f"Results have been written to {args.output}")
@@ -1,7 +1,111 @@
 import discord
+import os
 from discord.ext import commands
 
-intents = discord.Intents.default()
-intents.message_content = True
+# Total number of shards, "auto" for Discord's recommendation, unset to run unsharded
+shard_count = os.getenv("SHARD_COUNT")
 
-bot = commands.Bot(command_prefix="!!", intents=intents)
+# The shards run by this process like "0-3,6", unset for all of them
+shard_ids = os.getenv("SHARD_IDS")
+
+
+# Coroutine functions awaited once the bot has closed, for the resources of other modules
+close_callbacks = []
+
+
+def on_close(func):
+    """
+    Register func to be awaited once the bot has closed.
+    """
+    close_callbacks.append(func)
+    return func
+
+
+class ClosingMixin:
+    """
+    Awaits the close callbacks once the bot has closed, however it was stopped.
+    """
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            for callback in close_callbacks:
+                try:
+                    await callback()
+                except Exception as e:
+                    print(f"Failed to run {callback.__name__} on close: {e}")
+
+
+class Bot(ClosingMixin, commands.Bot):
+    pass
+
+
+class AutoShardedBot(ClosingMixin, commands.AutoShardedBot):
+    pass
+
+
+def parse_shard_ids(value):
+    """
+    :param value: Shard ids and inclusive ranges separated by commas, like "0-3,6".
+    :return: The sorted list of shard ids.
+    :raises ValueError: If a part isn't a number or a range like "0-3".
+    """
+    ids = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            if int(first) > int(last):
+                raise ValueError(f"The shard range {part!r} is reversed")
+            ids.update(range(int(first), int(last) + 1))
+        else:
+            ids.add(int(part))
+    return sorted(ids)
+
+
+def create_bot():
+    intents = discord.Intents.default()
+    intents.message_content = True
+
+    if shard_count is None:
+        return Bot(command_prefix="!!", intents=intents)
+
+    # Discord sends every guild's events to one shard, so the games of a channel
+    # always live in the process running that shard
+    if shard_count.strip().lower() == "auto":
+        if shard_ids:
+            # Which shards exist is only known once Discord recommends a count
+            raise SystemExit("SHARD_IDS can't be used with SHARD_COUNT=auto")
+        return AutoShardedBot(command_prefix="!!", intents=intents)
+
+    if not shard_count.strip().isdigit() or int(shard_count) < 1:
+        raise SystemExit(
+            f"SHARD_COUNT must be a positive number or auto, got {shard_count!r}"
+        )
+    count = int(shard_count)
+
+    ids = None
+    if shard_ids:
+        try:
+            ids = parse_shard_ids(shard_ids)
+        except ValueError as e:
+            raise SystemExit(
+                f'SHARD_IDS must be shard ids and ranges like "0-3,6", got {shard_ids!r}: {e}'
+            )
+        if any(shard_id >= count for shard_id in ids):
+            raise SystemExit(
+                f"SHARD_IDS {shard_ids!r} must be below SHARD_COUNT {count}"
+            )
+
+    return AutoShardedBot(
+        command_prefix="!!",
+        intents=intents,
+        shard_count=count,
+        shard_ids=ids,
+    )
+
+
+bot = create_bot()
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+import asyncio
+import time
+
+# Discord attachment URLs without an expiry are trusted for this long
+DEFAULT_URL_TTL = 6 * 60 * 60
+
+# Stop reusing a URL this many seconds before Discord expires it
+URL_EXPIRY_MARGIN = 5 * 60
+
+
+class CoverCache:
+    """
+    Covers revealed at the end of a game, kept in memory by songId.
+
+    Optionally remembers the Discord CDN URL of the first upload of a cover so
+    later reveals of the same song can link it instead of uploading it again.
+
+    :param max_bytes: Memory budget for the cover bytes.
+    :param reuse_urls: Whether to remember and reuse uploaded cover URLs.
+    """
+
+    def __init__(self, max_bytes, reuse_urls):
+        self.max_bytes = max_bytes
+        self.reuse_urls = reuse_urls
+
+        # Only touched from the event loop, so no locking is needed
+        self.covers = OrderedDict()
+        self.covers_bytes = 0
+        self.urls = {}
+
+    async def read(self, song_id, file_path):
+        """
+        Get the bytes of a cover, reading it from disk off the event loop on a miss.
+        """
+        cover = self.covers.get(song_id)
+        if cover is not None:
+            self.covers.move_to_end(song_id)
+            return cover
+
+        cover = await asyncio.to_thread(read_file, file_path)
+
+        if song_id not in self.covers and len(cover) <= self.max_bytes:
+            self.covers[song_id] = cover
+            self.covers_bytes += len(cover)
+
+            # Drop the least recently revealed covers until we are within budget
+            while self.covers_bytes > self.max_bytes:
+                _, old_cover = self.covers.popitem(last=False)
+                self.covers_bytes -= len(old_cover)
+
+        return cover
+
+    def get_url(self, song_id):
+        """
+        Get the URL of an earlier upload of a cover if it can still be used.
+        """
+        if not self.reuse_urls:
+            return None
+
+        entry = self.urls.get(song_id)
+        if entry is None:
+            return None
+
+        url, expires_at = entry
+        if time.time() >= expires_at:
+            del self.urls[song_id]
+            return None
+
+        return url
+
+    def remember_url(self, song_id, message):
+        """
+        Remember the URL Discord gave the cover uploaded with message.
+        """
+        if not self.reuse_urls or message is None:
+            return
+
+        url = None
+        if message.embeds and message.embeds[0].image.url:
+            url = message.embeds[0].image.url
+        elif message.attachments:
+            url = message.attachments[0].url
+
+        if url is not None:
+            self.urls[song_id] = (url, get_url_expiry(url))
+
+
+def read_file(file_path):
+    with open(file_path, "rb") as file:
+        return file.read()
+
+
+def get_url_expiry(url):
+    """
+    Get when a Discord CDN URL stops working, from its hex "ex" timestamp if present.
+    """
+    expires = parse_qs(urlparse(url).query).get("ex")
+    if expires:
+        try:
+            return int(expires[0], 16) - URL_EXPIRY_MARGIN
+        except ValueError:
+            pass
+
+    return time.time() + DEFAULT_URL_TTL
@@ -0,0 +1,227 @@
+import io
+import os
+import json
+import mmap
+import uuid
+from atomic_file import atomic_write
+
+# The packed covers and their index, built from the images folder by download_images.py
+cover_store_file = os.getenv("COVER_STORE", "covers.pack")
+
+MAGIC = b"COVERPK1"
+
+# The magic and a random id shared with the index, so a pack and an index from
+# different builds are never used together
+HEADER_SIZE = len(MAGIC) + 16
+
+INDEX_VERSION = 1
+
+
+def get_index_path(pack_path):
+    return pack_path + ".index"
+
+
+def build_cover_store(items, folder, pack_path=cover_store_file):
+    """
+    Pack the covers of the songs into one file with an index of their offsets.
+
+    :param items: Songs from full_song_data.json.
+    :param folder: The folder containing the covers named by songId.
+    :param pack_path: Where to write the pack, the index is written next to it.
+    :return: The number of packed covers.
+    """
+    build_id = uuid.uuid4()
+    covers = {}
+
+    # The pack and the index are both replaced at the end, the build id catches a
+    # bot opening the store in between
+    with atomic_write(pack_path, "wb") as pack:
+        pack.write(MAGIC + build_id.bytes)
+
+        for item in items:
+            _, file_extension = os.path.splitext(item["imageName"])
+            try:
+                with open(
+                    os.path.join(folder, f"{item['songId']}{file_extension}"), "rb"
+                ) as file:
+                    cover = file.read()
+            except FileNotFoundError:
+                continue
+
+            covers[item["songId"]] = (pack.tell(), len(cover), file_extension)
+            pack.write(cover)
+
+        with atomic_write(get_index_path(pack_path), "w", encoding="utf-8") as file:
+            json.dump(
+                {"version": INDEX_VERSION, "build_id": build_id.hex, "covers": covers},
+                file,
+            )
+
+    return len(covers)
+
+
+class CoverStore:
+    """
+    The packed covers, memory-mapped read-only.
+
+    Every process mapping the pack shares the same page-cached copy, and covers are
+    handed out as slices of the mapping without copying them.
+
+    :param pack_path: The pack written by build_cover_store.
+    """
+
+    def __init__(self, pack_path=cover_store_file):
+        with open(get_index_path(pack_path), "r", encoding="utf-8") as file:
+            index = json.load(file)
+
+        with open(pack_path, "rb") as pack:
+            self.map = mmap.mmap(pack.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = self.map[:HEADER_SIZE]
+        if (
+            index.get("version") != INDEX_VERSION
+            or header[: len(MAGIC)] != MAGIC
+            or header[len(MAGIC) :].hex() != index.get("build_id")
+        ):
+            self.map.close()
+            raise ValueError(f"'{pack_path}' doesn't match its index")
+
+        self.view = memoryview(self.map)
+        self.covers = index["covers"]
+
+    def __contains__(self, song_id):
+        return song_id in self.covers
+
+    def __len__(self):
+        return len(self.covers)
+
+    def get(self, song_id):
+        """
+        :return: A memoryview of the cover's encoded bytes, or None if it isn't packed.
+        """
+        entry = self.covers.get(song_id)
+        if entry is None:
+            return None
+
+        offset, length, _ = entry
+        return self.view[offset : offset + length]
+
+    def open(self, song_id):
+        """
+        :return: A read-only file object over the cover, or None if it isn't packed.
+        """
+        cover = self.get(song_id)
+        return None if cover is None else CoverFile(cover)
+
+
+class CoverFile(io.RawIOBase):
+    """
+    A file object over a packed cover, for Pillow and discord.File.
+
+    :param view: The memoryview of the cover.
+    """
+
+    def __init__(self, view):
+        super().__init__()
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else self.position + size
+        data = bytes(self.view[self.position : end])
+        self.position += len(data)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+def is_cover_store_current(items, folder, pack_path=cover_store_file):
+    """
+    Check that the store matches its index and packs the covers in folder as they are
+    now, from the file sizes alone so no cover is read.
+
+    :param items: Songs from full_song_data.json.
+    :param folder: The folder containing the covers named by songId.
+    :param pack_path: The pack written by build_cover_store.
+    """
+    try:
+        with open(get_index_path(pack_path), "r", encoding="utf-8") as file:
+            index = json.load(file)
+        with open(pack_path, "rb") as pack:
+            header = pack.read(HEADER_SIZE)
+    except (OSError, ValueError):
+        return False
+
+    if (
+        index.get("version") != INDEX_VERSION
+        or header[: len(MAGIC)] != MAGIC
+        or header[len(MAGIC) :].hex() != index.get("build_id")
+    ):
+        return False
+
+    covers = {}
+    for item in items:
+        _, file_extension = os.path.splitext(item["imageName"])
+        try:
+            size = os.path.getsize(
+                os.path.join(folder, f"{item['songId']}{file_extension}")
+            )
+        except OSError:
+            continue
+        covers[item["songId"]] = (size, file_extension)
+
+    packed = index.get("covers", {})
+    return packed.keys() == covers.keys() and all(
+        (length, file_extension) == covers[song_id]
+        for song_id, (_, length, file_extension) in packed.items()
+    )
+
+
+def open_cover_store(pack_path=cover_store_file):
+    """
+    Open the cover store if it has been built.
+
+    :return: The CoverStore, or None to read the covers from their files.
+    """
+    if not os.path.exists(pack_path):
+        return None
+
+    try:
+        store = CoverStore(pack_path)
+    except (OSError, ValueError) as e:
+        print(f"Not using the cover store: {e}")
+        return None
+
+    print(f"Using {len(store)} covers from '{pack_path}'")
+    return store
+
+
+if __name__ == "__main__":
+    from download_images import images_folder
+
+    with open("full_song_data.json", "r", encoding="utf-8") as file:
+        count = build_cover_store(json.load(file), images_folder)
+    print(f"Packed {count} covers into '{cover_store_file}'")
@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import asyncio
+
+
+class CropPool:
+    """
+    A bounded pool of ready-made puzzle crops, refilled in worker threads.
+
+    :param produce: Function creating a crop, returns (item, image_bytes, ...) or None.
+    :param size: How many crops to keep ready.
+    :param concurrency: How many crops may be produced at the same time.
+    :param max_bytes: Memory cap for the ready crops.
+    """
+
+    def __init__(self, produce, size, concurrency, max_bytes):
+        self.produce = produce
+        self.size = size
+        self.max_bytes = max_bytes
+        self.concurrency = max(1, concurrency)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="crop_worker"
+        )
+
+        self.crops = deque()
+        self.crops_bytes = 0
+        self.refilling = 0
+
+    async def get(self):
+        """
+        Take a ready crop, or produce one off the event loop if the pool is empty.
+
+        :return: The crop made by produce, or None if no crop could be produced.
+        """
+        if self.crops:
+            crop = self.crops.popleft()
+            self.crops_bytes -= len(crop[1])
+        else:
+            loop = asyncio.get_running_loop()
+            crop = await loop.run_in_executor(self.executor, self.produce)
+
+        self.refill()
+        return crop
+
+    def refill(self):
+        """
+        Start producing crops until the pool is full. Must run on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+
+        while (
+            self.refilling < self.concurrency
+            and len(self.crops) + self.refilling < self.size
+            and self.crops_bytes < self.max_bytes
+        ):
+            self.refilling += 1
+            future = loop.run_in_executor(self.executor, self.produce)
+            future.add_done_callback(self.on_produced)
+
+    def on_produced(self, future):
+        self.refilling -= 1
+
+        try:
+            crop = future.result()
+        except Exception as e:
+            # Don't retry right away, the next game will trigger another refill
+            print(f"Failed to prepare a crop: {e}")
+            return
+
+        if crop is None:
+            return
+
+        self.crops.append(crop)
+        self.crops_bytes += len(crop[1])
+        self.refill()
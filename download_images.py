@@ -1,52 +1,334 @@
 import os
 import json
+import time
+import hashlib
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from atomic_file import atomic_write
+from cover_store import build_cover_store, cover_store_file, is_cover_store_current
 
-# Create a folder for images if it doesn't exist
+# Folder for the images
 images_folder = "images"
-os.makedirs(images_folder, exist_ok=True)
+
+# Where the covers are downloaded from, can point at a local server for testing
+cover_url = os.getenv(
+    "COVER_URL", "https://dp4p6x0xfi5o9.cloudfront.net/chunithm/img/cover/"
+)
+
+# How many covers are downloaded at the same time
+download_concurrency = int(os.getenv("DOWNLOAD_CONCURRENCY", 16))
+
+# How many times a failed download is retried, waiting longer each time
+download_retries = int(os.getenv("DOWNLOAD_RETRIES", 3))
+retry_backoff = 0.5
+
+# Statuses worth retrying, anything else fails right away
+retry_statuses = (429, 500, 502, 503, 504)
+
+# Records the source and HTTP validators of every downloaded cover by songId
+manifest_file = "images_manifest.json"
+
+# Save the manifest after this many covers, so an interrupted run keeps its progress
+manifest_save_interval = 100
+
+# Covers checked against the CDN more recently than this aren't checked again
+revalidate_after = int(os.getenv("COVER_REVALIDATE_AFTER", 24 * 60 * 60))
+
+
+def load_manifest(path=manifest_file):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as parse_error:
+        print("Error parsing the manifest, all covers will be checked:", parse_error)
+        return {}
+
+
+def save_manifest(manifest, path=manifest_file):
+    with atomic_write(path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def is_entry_valid(entry, url, image_path):
+    # The manifest entry still describes the file on disk and its source
+    return (
+        entry is not None
+        and entry.get("imageName") == url
+        and os.path.exists(image_path)
+        and os.path.getsize(image_path) == entry.get("size")
+    )
+
+
+def create_session(concurrency):
+    # Keep one pooled connection per worker so connections are reused
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 # Function to download an image
-def download_image(url, image_name):
+def download_image(
+    session, url, image_name, base_url=cover_url, folder=images_folder, entry=None
+):
+    """
+    Download a cover, or check that it is still up to date.
+
+    Covers with a valid manifest entry are revalidated with a conditional request
+    once revalidate_after has passed. The image is written to a temporary file that
+    is only renamed once complete, so an interrupted run never leaves a truncated
+    image behind. A cover that can't be saved, like on a full disk, fails without
+    stopping the other downloads.
+
+    A cover already on disk without a manifest entry, left by an older version or
+    an interrupted run, is adopted as it is and revalidated later.
+
+    Returns:
+        tuple: (status, size, entry) where status is "fresh", "adopted", "unchanged",
+        "downloaded" or "failed", and entry is the new manifest entry or None.
+    """
     # Construct the full path to the image
-    image_path = os.path.join(images_folder, image_name)
+    image_path = os.path.join(folder, image_name)
+    headers = {}
 
-    # Check if the image already exists
-    if os.path.exists(image_path):
-        print(f"Image already exists: {image_name}")
-        return True
+    if entry is None and os.path.exists(image_path):
+        return "adopted", 0, adopt_image(url, image_name, image_path)
 
-    # Proceed to download the image if it doesn't exist
-    response = requests.get(
-        f"https://dp4p6x0xfi5o9.cloudfront.net/chunithm/img/cover/{url}", stream=True
-    )
+    if is_entry_valid(entry, url, image_path):
+        if time.time() - entry.get("checked", 0) < revalidate_after:
+            return "fresh", 0, entry
 
-    if response.status_code == 200:
-        with open(image_path, "wb") as writer:
-            for chunk in response.iter_content(chunk_size=8192):
-                writer.write(chunk)
-        print(f"Downloaded: {image_name}")
-        return True
-    else:
-        print(
-            f"Failed to download image: {url} with status code: {response.status_code}"
-        )
-        return False
-
-
-# Download songs from full_song_data.json
-with open("full_song_data.json", "r", encoding="utf-8") as file:
-    try:
-        json_array = json.load(file)
+        # Only ask for the image if it changed since we downloaded it
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("lastModified"):
+            headers["If-Modified-Since"] = entry["lastModified"]
+
+    for attempt in range(download_retries + 1):
+        if attempt > 0:
+            time.sleep(retry_backoff * 2 ** (attempt - 1))
+
+        try:
+            with session.get(
+                f"{base_url}{url}", headers=headers, stream=True, timeout=(10, 30)
+            ) as response:
+                if response.status_code == 304 and headers:
+                    return "unchanged", 0, {**entry, "checked": time.time()}
+
+                if response.status_code != 200:
+                    print(
+                        f"Failed to download image: {url} with status code: {response.status_code}"
+                    )
+                    if response.status_code in retry_statuses:
+                        continue
+                    break
+
+                size = 0
+                hash_object = hashlib.sha256()
+                with atomic_write(image_path, "wb") as writer:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        writer.write(chunk)
+                        hash_object.update(chunk)
+                        size += len(chunk)
+
+                new_entry = {
+                    "imageName": url,
+                    "file": image_name,
+                    "size": size,
+                    "sha256": hash_object.hexdigest(),
+                    "etag": response.headers.get("ETag"),
+                    "lastModified": response.headers.get("Last-Modified"),
+                    "checked": time.time(),
+                }
+
+            return "downloaded", size, new_entry
+
+        # RequestException is an OSError too, so it must come first
+        except requests.RequestException as err:
+            print(f"Failed to download image: {url} ({err})")
+        except OSError as err:
+            # Retrying won't make room on the disk or fix permissions
+            print(f"Failed to save image: {url} ({err})")
+            break
+
+    return "failed", 0, None
 
-        x = 0
-        for item in json_array:
+
+def adopt_image(url, image_name, image_path):
+    """
+    Create the manifest entry of a cover that is already on disk.
+
+    Without validators the first revalidation downloads the cover again, so it is
+    only checked once revalidate_after has passed.
+    """
+    size = 0
+    hash_object = hashlib.sha256()
+    with open(image_path, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            hash_object.update(chunk)
+            size += len(chunk)
+
+    return {
+        "imageName": url,
+        "file": image_name,
+        "size": size,
+        "sha256": hash_object.hexdigest(),
+        "etag": None,
+        "lastModified": None,
+        "checked": time.time(),
+    }
+
+
+def prune_images(expected_images, folder=images_folder):
+    """
+    Delete the files in folder that aren't the cover of any song.
+
+    Returns:
+        int: The number of deleted files.
+    """
+    removed = 0
+    for filename in os.listdir(folder):
+        if filename not in expected_images:
+            os.remove(os.path.join(folder, filename))
+            print(f"Removed: {filename}")
+            removed += 1
+
+    return removed
+
+
+def download_images(
+    items,
+    base_url=cover_url,
+    folder=images_folder,
+    concurrency=download_concurrency,
+    manifest_path=manifest_file,
+    prune=True,
+):
+    """
+    Sync the covers of the songs concurrently and print a summary.
+
+    Only new covers and covers that changed upstream are downloaded, and covers of
+    songs that no longer exist are deleted.
+
+    Args:
+        items (list): Songs from full_song_data.json.
+
+    Returns:
+        dict: The number of covers per status and the downloaded bytes.
+    """
+    os.makedirs(folder, exist_ok=True)
+
+    manifest = load_manifest(manifest_path)
+    new_manifest = {}
+
+    summary = {
+        "fresh": 0,
+        "adopted": 0,
+        "unchanged": 0,
+        "downloaded": 0,
+        "failed": 0,
+        "removed": 0,
+        "bytes": 0,
+    }
+    start_time = time.perf_counter()
+
+    with create_session(concurrency) as session:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        finished = False
+        try:
+            futures = {}
+            for item in items:
+                _, file_extension = os.path.splitext(item["imageName"])
+                image_name = f"{item['songId']}{file_extension}"
+                future = executor.submit(
+                    download_image,
+                    session,
+                    item["imageName"],
+                    image_name,
+                    base_url,
+                    folder,
+                    manifest.get(item["songId"]),
+                )
+                futures[future] = item["songId"]
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                song_id = futures[future]
+                status, size, entry = future.result()
+                summary[status] += 1
+                summary["bytes"] += size
+
+                # Keep the old entry when a check failed, the old file is still there
+                if entry is None:
+                    entry = manifest.get(song_id)
+                if entry is not None:
+                    new_manifest[song_id] = entry
+
+                if done % manifest_save_interval == 0:
+                    save_manifest({**manifest, **new_manifest}, manifest_path)
+
+                if done % 100 == 0 or done == len(futures):
+                    print(f"Progress: {done}/{len(futures)}")
+
+            finished = True
+        except KeyboardInterrupt:
+            # Drop the queued downloads, only wait for the ones already running
+            executor.shutdown(cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown()
+
+            # Keep the covers this run got to, and the old entries of the others
+            if not finished:
+                save_manifest({**manifest, **new_manifest}, manifest_path)
+
+    # An empty song list is more likely a broken file than an empty catalog
+    if prune and items:
+        expected_images = {entry["file"] for entry in new_manifest.values()}
+        for item in items:
             _, file_extension = os.path.splitext(item["imageName"])
-            image_name = f"{item['songId']}{file_extension}"
-            download_image(item["imageName"], image_name)
+            expected_images.add(f"{item['songId']}{file_extension}")
+        summary["removed"] = prune_images(expected_images, folder)
 
-    except json.JSONDecodeError as parse_error:
-        print("Error parsing JSON:", parse_error)
-    except Exception as err:
-        print("An error occurred:", err)
+    save_manifest(new_manifest, manifest_path)
+
+    elapsed = time.perf_counter() - start_time
+    megabytes = summary["bytes"] / 1024 / 1024
+    print(
+        f"Downloaded {summary['downloaded']}, unchanged {summary['unchanged']}, "
+        f"recently checked {summary['fresh']}, adopted {summary['adopted']}, "
+        f"failed {summary['failed']}, "
+        f"removed {summary['removed']}. {megabytes:.1f} MiB in {elapsed:.1f}s "
+        f"({megabytes / elapsed if elapsed > 0 else 0:.1f} MiB/s)"
+    )
+
+    return summary
+
+
+if __name__ == "__main__":
+    # Download songs from full_song_data.json
+    with open("full_song_data.json", "r", encoding="utf-8") as file:
+        try:
+            json_array = json.load(file)
+
+            summary = download_images(json_array)
+
+            # Repacking reads every cover, so only do it when the covers changed
+            if (
+                summary["downloaded"]
+                or summary["adopted"]
+                or summary["removed"]
+                or not is_cover_store_current(json_array, images_folder)
+            ):
+                count = build_cover_store(json_array, images_folder)
+                print(f"Packed {count} covers into '{cover_store_file}'")
+            else:
+                print(f"'{cover_store_file}' is up to date")
+
+        except json.JSONDecodeError as parse_error:
+            print("Error parsing JSON:", parse_error)
+        except Exception as err:
+            print("An error occurred:", err)
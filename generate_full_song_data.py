@@ -2,138 +2,348 @@ import re
 import requests
 import json
 import os
+import argparse
+import hashlib
 import cutlet
+from atomic_file import atomic_write
+from song_catalog import write_catalog, song_catalog_file
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+# Source: https://github.com/zvuc/otoge-db/blob/master/chunithm/data/music.json
+reading_source = "music.json"
 
-def get_aliases_dict(input_source):
-    aliases_dict = dict()
-    lines = []
+aliases_source = (
+    "https://raw.githubusercontent.com/lomotos10/GCM-bot/main/data/aliases/en/chuni.tsv"
+)
 
-    try:
-        # Check if the input source is a URL
-        if input_source.startswith("http://") or input_source.startswith("https://"):
-            response = requests.get(input_source)
-            response.raise_for_status()  # Raise an error for bad responses
-
-            # Split the response text into lines
-            lines = response.text.strip().split("\n")
-
-        # If not a URL, assume it's a file path
-        else:
-            if not os.path.exists(input_source):
-                print(f"Error: The file '{input_source}' was not found.")
-                return aliases_dict
-
-            # Read the TSV file
-            with open(input_source, "r", encoding="utf-8") as file:
-                lines = file.readlines()  # Read all lines
-
-        # Process each line
-        for line in lines:
-            aliases = line.strip().split("\t")
-            if len(aliases) >= 2:
-                aliases_dict[aliases[0]] = aliases[1:]
+# Where fetched sources are cached so unchanged sources cost a 304 and runs work offline
+source_cache_dir = os.getenv("SOURCE_CACHE_DIR", ".source_cache")
 
-        return aliases_dict
+# Worker processes used to romanize the titles, 1 romanizes in this process
+romanize_workers = int(os.getenv("ROMANIZE_WORKERS", 1))
 
-    except json.JSONDecodeError:
-        print("Error decoding JSON. Please ensure the content is valid JSON.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+# Creating a Cutlet builds a whole tokenizer, so keep one per spelling mode
+cutlets = {}
 
+# Romanized text by (text, use_foreign_spelling)
+romaji_cache = {}
 
-def get_reading_dict(input_source):
-    reading_dict = dict()
 
-    try:
-        # Check if the input source is a URL
-        if input_source.startswith("http://") or input_source.startswith("https://"):
-            response = requests.get(input_source)
-            response.raise_for_status()  # Raise an error for bad responses
+def romanize(text, use_foreign_spelling):
+    key = (text, use_foreign_spelling)
+    if key not in romaji_cache:
+        katsu = cutlets.get(use_foreign_spelling)
+        if katsu is None:
+            katsu = cutlet.Cutlet()
+            katsu.use_foreign_spelling = use_foreign_spelling
+            cutlets[use_foreign_spelling] = katsu
 
-            # Parse the JSON content from the URL
-            data = response.json()
+        romaji_cache[key] = katsu.romaji(text)
 
-            for item in data:
-                reading_dict[item["title"]] = item["reading"]
+    return romaji_cache[key]
 
-        # If not a URL, assume it's a file path
-        else:
-            if not os.path.exists(input_source):
-                print(f"Error: The file '{input_source}' was not found.")
-                return reading_dict
 
-            # Read the JSON file
-            with open(input_source, "r", encoding="utf-8") as file:
-                json_array = json.load(file)
+def romanize_title(title, reading=None):
+    """
+    Romanize a song title.
 
-            for item in json_array:
-                reading_dict[item["title"]] = item["reading"]
+    Args:
+        title (str): The song title.
+        reading (str): The reading of the title, if known.
 
-        return reading_dict
+    Returns:
+        tuple: (romonizedTitle, fullRomonizedTitle)
+    """
+    romonizedTitle = romanize(title, True)
+    fullRomonizedTitle = romanize(title, False)
 
-    except json.JSONDecodeError:
-        print("Error decoding JSON. Please ensure the content is valid JSON.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    # Some special characters cause the romonized title to become contain "?" only.
+    # In this case, we use the reading from reading_dict.
+    # Only do this if the romonized title contains "??" to avoid processing songs with title originally containing "?".
+    # Foreign spelling used to be switched off by this point, so both use it off.
+    if "??" in romonizedTitle and reading is not None:
+        romonizedTitle = romanize(reading, False)
+        fullRomonizedTitle = romanize(reading, False)
 
+    return romonizedTitle, fullRomonizedTitle
 
-def generate_full_song_data(input_source, output_file):
-    try:
-        data = None
 
-        # Check if the input source is a URL
-        if input_source.startswith("http://") or input_source.startswith("https://"):
-            response = requests.get(input_source)
-            response.raise_for_status()  # Raise an error for bad responses
+def romanize_titles(titles, workers=romanize_workers):
+    """
+    Romanize many titles, optionally spread across worker processes.
 
-            # Parse the JSON content from the URL
-            data = response.json()
+    Args:
+        titles (list): (title, reading) pairs.
+        workers (int): The number of worker processes, 1 romanizes in this process.
 
-        # If not a URL, assume it's a file path
-        else:
-            if not os.path.exists(input_source):
-                print(f"Error: The file '{input_source}' was not found.")
-                return
+    Returns:
+        dict: (romonizedTitle, fullRomonizedTitle) by (title, reading).
+    """
+    # Every title only needs to be romanized once
+    titles = list(dict.fromkeys(titles))
 
-            # Read the JSON file
-            with open(input_source, "r", encoding="utf-8") as file:
-                data = json.load(file)
+    if workers <= 1 or len(titles) < 2:
+        return {pair: romanize_title(*pair) for pair in titles}
 
-        result = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(titles) // (workers * 4))
+        results = executor.map(
+            romanize_title,
+            [title for title, _ in titles],
+            [reading for _, reading in titles],
+            chunksize=chunksize,
+        )
+        return dict(zip(titles, results))
+
+
+def is_url(input_source):
+    return input_source.startswith("http://") or input_source.startswith("https://")
+
+
+def get_cache_paths(url, cache_dir):
+    # Name the cached files after the URL so every source gets its own
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{key}.body"), os.path.join(
+        cache_dir, f"{key}.json"
+    )
+
+
+def fetch_cached(url, cache_dir=source_cache_dir, offline=False):
+    """
+    Fetch a URL, revalidating a copy cached on disk.
+
+    The cached copy is sent with its validators so an unchanged source costs a 304,
+    and it is used as is when offline or when the source can't be reached.
 
-        reading_dict = get_reading_dict(
-            "music.json"
-        )  # Source: https://github.com/zvuc/otoge-db/blob/master/chunithm/data/music.json
+    Args:
+        url (str): The URL to fetch.
+        cache_dir (str): Where the cached copies are kept.
+        offline (bool): Only use the cached copy.
 
-        aliases_dict = get_aliases_dict(
-            "https://raw.githubusercontent.com/lomotos10/GCM-bot/main/data/aliases/en/chuni.tsv"
+    Returns:
+        str: The content of the source.
+    """
+    body_path, meta_path = get_cache_paths(url, cache_dir)
+
+    meta = None
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+
+    if offline:
+        if meta is None:
+            raise RuntimeError(f"'{url}' is not cached, can't use it offline.")
+        with open(body_path, "r", encoding="utf-8") as file:
+            return file.read()
+
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("lastModified"):
+            headers["If-Modified-Since"] = meta["lastModified"]
+
+    try:
+        response = requests.get(url, headers=headers, timeout=(10, 60))
+        if response.status_code == 304 and meta is not None:
+            with open(body_path, "r", encoding="utf-8") as file:
+                return file.read()
+        response.raise_for_status()  # Raise an error for bad responses
+    except requests.RequestException as e:
+        if meta is None:
+            raise
+        print(f"Failed to fetch '{url}', using the cached copy: {e}")
+        with open(body_path, "r", encoding="utf-8") as file:
+            return file.read()
+
+    text = response.content.decode("utf-8")
+
+    # The body goes first, so validators never describe a body that wasn't written
+    os.makedirs(cache_dir, exist_ok=True)
+    with atomic_write(body_path, "w", encoding="utf-8") as file:
+        file.write(text)
+    with atomic_write(meta_path, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "lastModified": response.headers.get("Last-Modified"),
+            },
+            file,
         )
 
-        # Process each item in the JSON array
-        for item in data["songs"]:
-            if item["category"] == "WORLD'S END":
-                continue
+    return text
 
-            katsu = cutlet.Cutlet()
-            romonizedTitle = katsu.romaji(item["title"])
 
-            katsu.use_foreign_spelling = False
-            fullRomonizedTitle = katsu.romaji(item["title"])
+def read_source(input_source, offline=False):
+    """
+    Read a source from a URL through the cache, or from a file path.
 
-            # Some special characters cause the romonized title to become contain "?" only.
-            # In this case, we use the reading from reading_dict.
-            # Only do this if the romonized title contains "??" to avoid processing songs with title originally containing "?".
-            if "??" in romonizedTitle and item["title"] in reading_dict:
-                romonizedTitle = katsu.romaji(reading_dict[item["title"]])
+    Returns:
+        str: The content of the source, None if the file doesn't exist.
+    """
+    if is_url(input_source):
+        return fetch_cached(input_source, offline=offline)
 
-                katsu.use_foreign_spelling = False
-                fullRomonizedTitle = katsu.romaji(reading_dict[item["title"]])
+    if not os.path.exists(input_source):
+        print(f"Error: The file '{input_source}' was not found.")
+        return None
+
+    with open(input_source, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def get_aliases_dict(input_source, offline=False):
+    aliases_dict = dict()
+
+    text = read_source(input_source, offline)
+    if text is None:
+        return aliases_dict
+
+    # Process each line
+    for line in text.strip().split("\n"):
+        aliases = line.strip().split("\t")
+        if len(aliases) >= 2:
+            aliases_dict[aliases[0]] = aliases[1:]
+
+    return aliases_dict
+
+
+def get_reading_dict(input_source, offline=False):
+    reading_dict = dict()
+
+    text = read_source(input_source, offline)
+    if text is None:
+        return reading_dict
+
+    for item in json.loads(text):
+        reading_dict[item["title"]] = item["reading"]
+
+    return reading_dict
+
+
+def load_existing_songs(output_file):
+    """
+    Load a previously generated song data file.
+
+    Returns:
+        dict: The songs by songId, empty if there is no usable file.
+    """
+    try:
+        with open(output_file, "r", encoding="utf-8") as file:
+            return {song["songId"]: song for song in json.load(file)}
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, KeyError, TypeError):
+        print(f"Error: '{output_file}' is not valid song data, ignoring it.")
+        return {}
+
+
+def report_changes(existing_songs, result):
+    # Print what changed compared to the previous song data file
+    songs = {song["songId"]: song for song in result}
+
+    added = [song for song_id, song in songs.items() if song_id not in existing_songs]
+    removed = [song for song_id, song in existing_songs.items() if song_id not in songs]
+    changed = [
+        song
+        for song_id, song in songs.items()
+        if song_id in existing_songs and existing_songs[song_id] != song
+    ]
+
+    for label, changed_songs in (
+        ("Added", added),
+        ("Changed", changed),
+        ("Removed", removed),
+    ):
+        print(f"{label}: {len(changed_songs)}")
+        for song in changed_songs:
+            print(f"  {song['songId']}: {song['title']}")
+
+
+def get_song_id(item):
+    # Replace invalid characters with underscores
+    return re.sub(r'[<>:"/\\|?*]', "_", item.get("songId"))
+
+
+def generate_full_song_data(
+    input_source,
+    output_file,
+    workers=romanize_workers,
+    incremental=False,
+    catalog_file=song_catalog_file,
+    offline=False,
+):
+    """
+    Generate the song data file used by the bot.
+
+    Args:
+        input_source (str): URL or file path of the upstream data.json.
+        output_file (str): Where to write the song data.
+        workers (int): The number of processes used for romanization.
+        incremental (bool): Reuse the romanization of songs whose title and reading
+            didn't change since the existing output_file was generated.
+        catalog_file (str): Where to write the compact catalog loaded by the bot.
+        offline (bool): Only use the cached copies of the sources.
+    """
+    try:
+        # Fetch the song data, readings and aliases at the same time
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            data_future = executor.submit(read_source, input_source, offline)
+            reading_future = executor.submit(get_reading_dict, reading_source, offline)
+            aliases_future = executor.submit(get_aliases_dict, aliases_source, offline)
+
+            data_text = data_future.result()
+            if data_text is None:
+                return
+            data = json.loads(data_text)
+
+            reading_dict = reading_future.result()
+            aliases_dict = aliases_future.result()
+
+        result = []
+
+        songs = [item for item in data["songs"] if item["category"] != "WORLD'S END"]
+
+        existing_songs = load_existing_songs(output_file)
+
+        # Romanization only depends on the title and its reading, so songs where
+        # neither changed can keep their previous romanization
+        romanized_titles = {}
+        if incremental:
+            for item in songs:
+                existing_song = existing_songs.get(get_song_id(item))
+                reading = reading_dict.get(item["title"])
+                if (
+                    existing_song is not None
+                    and existing_song.get("title") == item["title"]
+                    and existing_song.get("reading") == reading
+                ):
+                    romanized_titles[(item["title"], reading)] = (
+                        existing_song["romonizedTitle"],
+                        existing_song["fullRomonizedTitle"],
+                    )
+
+        # Romanize the remaining titles up front, this is the slow part
+        titles = [
+            (item["title"], reading_dict.get(item["title"]))
+            for item in songs
+            if (item["title"], reading_dict.get(item["title"])) not in romanized_titles
+        ]
+        if incremental:
+            print(
+                f"Reusing {len(romanized_titles)} romanized titles, romanizing {len(set(titles))}"
+            )
+        romanized_titles.update(romanize_titles(titles, workers))
+
+        # Process each item in the JSON array
+        for item in songs:
+            romonizedTitle, fullRomonizedTitle = romanized_titles[
+                (item["title"], reading_dict.get(item["title"]))
+            ]
 
             song = {
-                "songId": re.sub(
-                    r'[<>:"/\\|?*]', "_", item.get("songId")
-                ),  # Replace invalid characters with underscores
+                "songId": get_song_id(item),
                 "category": item.get("category"),
                 "artist": item.get("artist"),
                 "title": item.get("title"),
@@ -161,6 +371,12 @@ def generate_full_song_data(input_source, output_file):
 
         print(f"JSON data has been written to {output_file}")
 
+        # The bot loads this smaller catalog instead of the full JSON data
+        write_catalog(result, catalog_file)
+        print(f"Song catalog has been written to {catalog_file}")
+
+        report_changes(existing_songs, result)
+
     except FileNotFoundError:
         print(f"Error: The file '{input_source}' was not found.")
     except json.JSONDecodeError:
@@ -173,4 +389,26 @@ input_source = "https://dp4p6x0xfi5o9.cloudfront.net/chunithm/data.json"
 output_file = "full_song_data.json"
 
 
-generate_full_song_data(input_source, output_file)
+# Worker processes import this file again, so only generate when run directly
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate full_song_data.json")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only romanize songs that are new or changed since the last run",
+    )
+    parser.add_argument("--workers", type=int, default=romanize_workers)
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="only use the cached copies of the sources",
+    )
+    args = parser.parse_args()
+
+    generate_full_song_data(
+        input_source,
+        output_file,
+        args.workers,
+        args.incremental,
+        offline=args.offline,
+    )
@@ -1,141 +1,296 @@
 from datetime import datetime, timedelta
 import hashlib
 import math
-from PIL import Image
+import threading
+import time
 from io import BytesIO
 import discord
 import os
-import json
 import random
 import asyncio
-import difflib
 from bot import bot
+from answer_matcher import AnswerMatcher
+from crop_pool import CropPool
+from cover_cache import CoverCache
+from cover_store import open_cover_store
+from song_catalog import load_catalog
+from score_store import ScoreStore
+from metrics import metrics
 
 time_limit = 20
 
-active_game = None
+# Fraction of the cover shown at the start of a game
+crop_fraction = 0.4
 
-with open("full_song_data.json", "r", encoding="utf-8") as f:
-    data = json.load(f)
+# Crops prepared ahead of time so starting a game doesn't have to
+crop_pool_size = int(os.getenv("CROP_POOL_SIZE", 8))
+crop_pool_concurrency = int(os.getenv("CROP_POOL_CONCURRENCY", 2))
+crop_pool_max_bytes = int(os.getenv("CROP_POOL_MAX_BYTES", 32 * 1024 * 1024))
 
+# Encoding of crops from covers without transparency, "JPEG" or "WEBP"
+crop_lossy_format = os.getenv("CROP_FORMAT", "JPEG").upper()
+crop_quality = int(os.getenv("CROP_QUALITY", 85))
 
-def is_correct_guess(guess):
-    global active_game
-    item = active_game["item"]
+# Largest width and height of a crop in pixels, larger crops are scaled down, 0 disables the cap
+crop_max_size = int(os.getenv("CROP_MAX_SIZE", 0))
 
-    guess = guess.lower()
+# Revealed covers kept in memory, and optionally their Discord URLs for reuse
+cover_cache_bytes = int(os.getenv("COVER_CACHE_BYTES", 64 * 1024 * 1024))
+reuse_cover_urls = os.getenv("REUSE_COVER_URLS", "false").lower() in ("1", "true")
 
-    item_fields = {
-        "title": item["title"],
-        "reading": item.get("reading", ""),
-        "romonizedTitle": item.get("romonizedTitle", ""),
-        "fullRomonizedTitle": item.get("fullRomonizedTitle", ""),
-        "aliases": item.get("aliases", []),
-    }
+# Where finished games are recorded, and how long the writer collects them per batch
+score_db_file = os.getenv("SCORE_DB", "scores.db")
+score_flush_interval = float(os.getenv("SCORE_FLUSH_INTERVAL", 2))
+
+# Players shown by /leaderboard
+leaderboard_limit = 10
+
+# Running games keyed by channel id, channel ids are unique across guilds
+active_games = {}
+
+# The songs and their precompiled answers, loaded by load_songs on first use
+data = None
+answer_matchers = None
+
+# The memory-mapped packed covers, opened by load_songs if they have been built
+cover_store = None
+
+# Fuzzy search over the whole catalog for /song, built by load_songs
+song_index = None
+
+# Results shown by /song and its autocomplete
+song_search_limit = 10
+songs_lock = threading.Lock()
+
+# Hashed attachment filenames of the covers by songId, filled by get_cover_filename
+cover_filenames = {}
 
-    """ def get_threshold(length):
-        if length < 5:
-            return 0.7
-        elif length > 30:
-            return 0.52
-        return 0.35 * math.exp(-0.06 * (length - 5)) + 0.35 """
-
-    def get_threshold(length):
-        if length < 5:
-            return 0.6
-        elif length > 30:
-            return 0.45
-        return 0.2 * math.exp(-0.1 * (length - 5)) + 0.45
-
-    for field_name, field_value in item_fields.items():
-        if (
-            isinstance(field_value, str) and len(field_value) >= 3
-        ):  # Check only valid string fields
-            threshold = get_threshold(len(field_value))
-            similarity = difflib.SequenceMatcher(
-                None, guess, field_value.lower()
-            ).ratio()
-            """ print(
-                f"Similarity for {field_name}: {similarity:.2f} (Threshold: {threshold:.2f})"
-            ) """
-            if similarity > threshold:
-                return True
-
-    # Check aliases
-    for alias in item_fields["aliases"]:
-        if len(alias) >= 3:
-            similarity = difflib.SequenceMatcher(None, guess, alias.lower()).ratio()
-            threshold = get_threshold(len(alias))
-            """ print(
-                f"Similarity for alias: {similarity:.2f} (Threshold: {threshold:.2f})"
-            ) """
-            if similarity > threshold:
-                return True
-
-    return False
-
-
-async def wait_for_guess(ctx):
-    global active_game
-
-    def check(m):
-        return m.channel == ctx.channel and m.author != bot.user
-
-    while True:
-        try:
-            current_time = datetime.now()
-            end_time = active_game["end_time"]
-            time_difference = (end_time - current_time).total_seconds()
-
-            guess_msg = await bot.wait_for(
-                "message", check=check, timeout=time_difference
+cover_cache = CoverCache(cover_cache_bytes, reuse_cover_urls)
+
+score_store = ScoreStore(score_db_file, score_flush_interval)
+
+
+def load_songs():
+    """
+    Load the song catalog and precompile the accepted answers of every song once.
+
+    Blocks, so call it from a worker thread when on the event loop.
+
+    :return: The list of songs.
+    """
+    global data, answer_matchers, cover_store, song_index
+    with songs_lock:
+        if data is None:
+            start = time.perf_counter()
+            songs = load_catalog()
+            answer_matchers = {item.songId: AnswerMatcher(item) for item in songs}
+            cover_store = open_cover_store()
+
+            # Imported here so numpy only loads with the catalog, not at bot start
+            from song_search import SongIndex
+
+            song_index = SongIndex(songs)
+
+            # Set last, other threads only check data
+            data = songs
+            print(
+                f"Loaded {len(data)} songs in {(time.perf_counter() - start) * 1000:.0f} ms"
             )
 
-            if is_correct_guess(guess_msg.content):
-                await send_correct_message(ctx, guess_msg)
+    return data
+
+
+@metrics.timed("guess_match_seconds")
+def is_correct_guess(game, guess):
+    return game["matcher"].is_correct(guess)
+
+
+def get_active_game(channel_id):
+    return active_games.get(channel_id)
+
+
+def end_game(game):
+    """
+    Stop a game and remove it from the registry if it is still the active one.
+
+    :param game: The game state created by init_game.
+    :return: True if the game was still active.
+    """
+    if active_games.get(game["channel_id"]) is not game:
+        return False
+
+    del active_games[game["channel_id"]]
+
+    # Don't cancel the task from inside itself, it is already finishing
+    task = game.get("task")
+    if task is not None and task is not asyncio.current_task():
+        task.cancel()
+
+    return True
+
+
+@bot.listen("on_message")
+async def dispatch_guess(message):
+    # Hand the message to the game running in its channel, if any
+    game = get_active_game(message.channel.id)
+    if game is None or "guesses" not in game or message.author == bot.user:
+        return
+
+    game["guesses"].put_nowait(message)
+
+
+async def wait_for_guess(ctx, game):
+    try:
+        while True:
+            try:
+                current_time = datetime.now()
+                end_time = game["end_time"]
+                time_difference = (end_time - current_time).total_seconds()
+
+                guess_msg = await asyncio.wait_for(
+                    game["guesses"].get(), timeout=time_difference
+                )
+
+                correct = is_correct_guess(game, guess_msg.content)
+                metrics.inc("guesses_evaluated_total", correct=correct)
+
+                if correct:
+                    end_game(game)
+                    record_game(game, "correct", guess_msg.author)
+                    await send_correct_message(ctx, guess_msg, game["item"])
+                    break
+
+            except asyncio.TimeoutError:
+                end_game(game)
+                record_game(game, "timeout")
+                await send_times_up_message(ctx, game["item"])
+                break
+
+            except asyncio.CancelledError:
                 break
+    finally:
+        # Make sure finished games never stay in the registry
+        end_game(game)
 
-        except asyncio.TimeoutError:
-            await send_times_up_message(ctx)
-            break
 
-        except asyncio.CancelledError:
-            break
+def record_game(game, outcome, winner=None):
+    """
+    Record the outcome of a finished game for the metrics, leaderboards and song stats.
 
-    active_game = None
+    :param outcome: "correct", "skipped" or "timeout".
+    :param winner: The user who guessed correctly.
+    """
+    metrics.inc("games_finished_total", outcome=outcome)
+
+    solve_seconds = None
+    if winner is not None:
+        solve_seconds = (datetime.now() - game["start_time"]).total_seconds()
+
+    score_store.record_game(
+        game["guild_id"],
+        game["channel_id"],
+        game["item"].songId,
+        outcome,
+        winner.id if winner is not None else None,
+        solve_seconds,
+    )
 
 
-async def init_game(ctx):
-    global active_game
-    # Check if a game is already active in this channel
-    if active_game != None:
-        # Cancel the previous game logic
-        active_game["task"].cancel()
-        active_game = None  # Remove the existing game state
+def generate_crop():
+    """
+    Pick a random song and crop its cover, runs in the crop pool's worker threads.
 
+    :return: (item, image_bytes, file_extension), or None if the cover is missing.
+    """
     # Randomly select an item from the JSON data
-    item = random.choice(data)
-    image_path = get_file_path(item)
+    item = random.choice(load_songs())
+
+    # Read the cover straight from the mapped store when it is packed
+    image_source = cover_store.open(item.songId) if cover_store is not None else None
+    if image_source is None:
+        image_source = get_file_path(item)
+
+        # Check if the image exists
+        if not os.path.exists(image_source):
+            return None
+
+    image_bytes, file_extension = get_random_square_fraction(
+        image_source, crop_fraction
+    )
+
+    return item, image_bytes.getvalue(), file_extension
+
+
+crop_pool = CropPool(
+    generate_crop, crop_pool_size, crop_pool_concurrency, crop_pool_max_bytes
+)
+
+
+metrics.gauge("active_games", lambda: len(active_games))
+metrics.gauge("crop_pool_ready", lambda: len(crop_pool.crops))
+metrics.gauge("crop_pool_bytes", lambda: crop_pool.crops_bytes)
 
-    # Check if the image exists
-    if not os.path.exists(image_path):
+
+@bot.listen("on_ready")
+async def warm_up_game():
+    # Load the songs and fill the crop pool in the background once connected,
+    # so neither delays startup
+    await asyncio.to_thread(load_songs)
+    crop_pool.refill()
+    await asyncio.to_thread(score_store.open)
+
+
+@metrics.timed("init_game_seconds")
+async def init_game(ctx):
+    channel_id = ctx.channel.id
+
+    # Take a ready crop, the pool refills itself in the background
+    crop = await crop_pool.get()
+    if crop is None:
         await ctx.send("Image not found!")
         return
 
-    # Send the image to the channel
-    await send_start_message(ctx, image_path)
+    item, cropped_image, file_extension = crop
+
+    # Check if a game is already active in this channel
+    previous_game = get_active_game(channel_id)
+    if previous_game is not None:
+        # Cancel the previous game logic and remove its state
+        end_game(previous_game)
 
     # Set the game active for this channel
-    active_game = {
+    game = {
+        "channel_id": channel_id,
+        # Games in direct messages count towards their own leaderboard
+        "guild_id": ctx.guild.id if ctx.guild is not None else 0,
         "item": item,
-        "start_time": datetime.now(),
-        "end_time": datetime.now() + timedelta(seconds=time_limit),
+        "matcher": answer_matchers[item.songId],
     }
+    active_games[channel_id] = game
 
-    """ print(item["title"]) """
+    # Send the image to the channel
+    try:
+        await send_start_message(ctx, game, BytesIO(cropped_image), file_extension)
+    except BaseException:
+        # Without a start message nobody can play, and the game would never time out.
+        # BaseException so a cancelled command cleans up too
+        end_game(game)
+        raise
+
+    # Another game may have been started in this channel while sending
+    if get_active_game(channel_id) is not game:
+        return
+
+    game["start_time"] = datetime.now()
+    game["end_time"] = game["start_time"] + timedelta(seconds=time_limit)
+
+    # Guesses are routed here by dispatch_guess from now on
+    game["guesses"] = asyncio.Queue()
+
+    """ print(item.title) """
 
     # Run the waiting for guess logic in a separate task
-    active_game["task"] = asyncio.create_task(wait_for_guess(ctx))
+    game["task"] = asyncio.create_task(wait_for_guess(ctx, game))
 
 
 class NewGameView(discord.ui.View):
@@ -159,9 +314,10 @@ class NewGameView(discord.ui.View):
 
 
 class SkipGameView(discord.ui.View):
-    def __init__(self, ctx):
+    def __init__(self, ctx, game):
         super().__init__()
         self.ctx = ctx
+        self.game = game
 
         button = discord.ui.Button(
             label="⏩",
@@ -169,12 +325,10 @@ class SkipGameView(discord.ui.View):
         )
 
         async def button_callback(interaction):
-            await send_skip_message(self.ctx)
-            global active_game
-            if active_game != None:
-                # Cancel the previous game logic
-                active_game["task"].cancel()
-                active_game = None  # Remove the existing game state
+            # Only skip the game this message belongs to, if it is still running
+            if end_game(self.game):
+                record_game(self.game, "skipped")
+                await send_skip_message(self.ctx, self.game["item"])
             await interaction.message.edit(
                 view=None,
             )
@@ -183,9 +337,10 @@ class SkipGameView(discord.ui.View):
         self.add_item(button)
 
 
-async def send_start_message(ctx, file_path: str):
-    # Extract the filename from the file path
-    filename = hash_filename(file_path)
+@metrics.timed("send_seconds", message="start")
+async def send_start_message(ctx, game, cropped_image_bytes, file_extension):
+    # Use the cover's hashed filename, the crop may use another format
+    filename = os.path.splitext(get_cover_filename(game["item"]))[0] + file_extension
 
     # Create the embed
     embed = discord.Embed(
@@ -193,16 +348,17 @@ async def send_start_message(ctx, file_path: str):
         description=f"You have {time_limit} seconds to guess the song.",
     )
 
-    # Get the cropped image as a BytesIO object
-    cropped_image_bytes = get_random_square_fraction(file_path, 0.4)
-
     # Create a Discord file from the BytesIO object
     file = discord.File(cropped_image_bytes, filename=filename)
 
     # Set the image using the filename
     embed.set_image(url=f"attachment://{filename}")
 
-    view = SkipGameView(ctx)
+    view = SkipGameView(ctx, game)
+
+    metrics.inc(
+        "bytes_uploaded_total", cropped_image_bytes.getbuffer().nbytes, image="crop"
+    )
 
     # Send the message with the file and embed
     await ctx.send(
@@ -210,82 +366,140 @@ async def send_start_message(ctx, file_path: str):
     )
 
 
-async def send_correct_message(ctx, msg):
-    # Extract the filename from the file path
-    item = active_game["item"]
-    file_path = get_file_path(item)
-    filename = hash_filename(file_path)
-
-    # Create the embed
-    embed = discord.Embed(
-        description=f"**Answer**: {item['title']}\n\n**Artist**: {item['artist']}\n**Category**: {item['category']}\n",
+async def send_correct_message(ctx, msg, item):
+    await send_answer_message(
+        ctx, f"{msg.author.mention} has the correct answer!", item
     )
-    file = discord.File(file_path, filename=filename)
 
-    # Set the image using the filename
-    embed.set_image(url=f"attachment://{filename}")
 
-    view = NewGameView(ctx)
+async def send_times_up_message(ctx, item):
+    await send_answer_message(ctx, "Time's up!", item)
 
-    # Send the message with the file and embed
-    await ctx.send(
-        f"{msg.author.mention} has the correct answer!",
-        file=file,
-        embed=embed,
-        view=view,
-    )
 
+async def send_skip_message(ctx, item):
+    await send_answer_message(ctx, "Skipped!", item)
 
-async def send_times_up_message(ctx):
-    # Extract the filename from the file path
-    item = active_game["item"]
-    file_path = get_file_path(item)
-    filename = hash_filename(file_path)
 
+@metrics.timed("send_seconds", message="answer")
+async def send_answer_message(ctx, content, item):
     # Create the embed
     embed = discord.Embed(
-        description=f"**Answer**: {item['title']}\n\n**Artist**: {item['artist']}\n**Category**: {item['category']}\n",
+        description=f"**Answer**: {item.title}\n\n**Artist**: {item.artist}\n**Category**: {item.category}\n",
     )
-    file = discord.File(file_path, filename=filename)
 
-    # Set the image using the filename
-    embed.set_image(url=f"attachment://{filename}")
+    await send_cover_message(ctx, content, embed, item, NewGameView(ctx))
 
-    view = NewGameView(ctx)
 
-    # Send the message with the file and embed
-    await ctx.send("Time's up!", file=file, embed=embed, view=view)
+async def send_cover_message(ctx, content, embed, item, view=None):
+    """
+    Send an embed showing the cover of a song.
 
+    :param embed: The embed to set the cover image of.
+    :param item: The Song whose cover to show.
+    """
+    song_id = item.songId
 
-async def send_skip_message(ctx):
-    # Extract the filename from the file path
-    item = active_game["item"]
-    file_path = get_file_path(item)
-    filename = hash_filename(file_path)
+    # Link the earlier upload of this cover if Discord still serves it
+    url = cover_cache.get_url(song_id)
+    if url is not None:
+        embed.set_image(url=url)
+        await ctx.send(content, embed=embed, view=view)
+        return
 
-    # Create the embed
-    embed = discord.Embed(
-        description=f"**Answer**: {item['title']}\n\n**Artist**: {item['artist']}\n**Category**: {item['category']}\n",
-    )
-    file = discord.File(file_path, filename=filename)
+    filename = get_cover_filename(item)
+
+    # Packed covers are already in memory, shared with the other processes
+    cover = cover_store.get(song_id) if cover_store is not None else None
+    if cover is None:
+        file_path = get_file_path(item)
+        if not os.path.exists(file_path):
+            await ctx.send(content, embed=embed, view=view)
+            return
+        cover = await cover_cache.read(song_id, file_path)
+
+    # A BytesIO lets the upload know its size up front
+    file = discord.File(BytesIO(cover), filename=filename)
+    metrics.inc("bytes_uploaded_total", len(cover), image="cover")
 
     # Set the image using the filename
     embed.set_image(url=f"attachment://{filename}")
 
-    view = NewGameView(ctx)
-
     # Send the message with the file and embed
-    await ctx.send("Skipped!", file=file, embed=embed, view=view)
+    message = await ctx.send(content, file=file, embed=embed, view=view)
+    cover_cache.remember_url(song_id, message)
+
+
+async def send_song_message(ctx, query):
+    # Load the catalog if no game has been played yet
+    if song_index is None:
+        await asyncio.to_thread(load_songs)
+
+    # Autocomplete fills in the songId of the chosen song
+    item = song_index.get(query)
+    results = song_index.search(query, song_search_limit)
+    if item is None:
+        if not results:
+            await ctx.send("No song found!")
+            return
+        item = results[0][0]
+
+    description = f"**Artist**: {item.artist}\n**Category**: {item.category}\n"
+    if item.aliases:
+        description += f"**Aliases**: {', '.join(item.aliases)}\n"
+
+    stats = score_store.get_song_stats(item.songId)
+    if stats is not None:
+        description += f"**Played**: {stats.played}\n**Guessed**: {stats.correct}\n"
+        if stats.correct:
+            average = stats.solve_seconds / stats.correct
+            description += f"**Average time**: {average:.1f} seconds\n"
+
+    other_titles = [song.title for song, _ in results if song is not item]
+    if other_titles:
+        description += "\n**Other matches**: " + ", ".join(other_titles[:5])
+
+    embed = discord.Embed(title=item.title, description=description)
+    await send_cover_message(ctx, None, embed, item)
+
+
+async def send_leaderboard_message(ctx):
+    guild_id = ctx.guild.id if ctx.guild is not None else 0
+    leaderboard = score_store.get_leaderboard(guild_id, leaderboard_limit)
+    if not leaderboard:
+        await ctx.send("No one has guessed a song here yet!")
+        return
+
+    # Mentions in embeds show the name without pinging anyone
+    description = "\n".join(
+        f"**{rank}.** <@{user_id}>: {wins} {'win' if wins == 1 else 'wins'}"
+        for rank, (user_id, wins) in enumerate(leaderboard, start=1)
+    )
+    embed = discord.Embed(title="Leaderboard", description=description)
+    await ctx.send(embed=embed)
+
+
+def autocomplete_songs(current):
+    """
+    :return: A list of (title, songId) of the songs best matching current, empty
+        until the catalog has been loaded so autocomplete never waits for it.
+    """
+    if song_index is None or not current.strip():
+        return []
+
+    return [(song.title, song.songId) for song, _ in song_index.search(current)]
 
 
 def get_random_square_fraction(image_path, fraction):
     """
     Select a random square fraction from an image.
 
-    :param image_path: Path to the input image.
+    :param image_path: Path to the input image, or a file object of it.
     :param fraction: The fraction of the image size (0 < fraction <= 1).
-    :return: A BytesIO object containing the cropped image.
+    :return: A BytesIO object containing the cropped image and its file extension.
     """
+    # Imported here so Pillow isn't loaded before the first game
+    from PIL import Image
+
     # Open the image
     with Image.open(image_path) as img:
         # Get dimensions
@@ -298,31 +512,116 @@ def get_random_square_fraction(image_path, fraction):
         x = random.randint(0, img_width - square_size)
         y = random.randint(0, img_height - square_size)
 
-        # Crop the image to get the square fraction
-        square_image = img.crop((x, y, x + square_size, y + square_size))
+        if crop_max_size and square_size > crop_max_size:
+            square_image = crop_reduced(img, x, y, square_size, crop_max_size)
+        else:
+            # Crop the image to get the square fraction
+            square_image = img.crop((x, y, x + square_size, y + square_size))
 
         # Save cropped image to BytesIO
-        img_byte_arr = BytesIO()
-        square_image.save(img_byte_arr, format="PNG")
-        img_byte_arr.seek(0)  # Reset the pointer to the start of the stream
+        return encode_image(square_image, get_crop_format(img))
+
 
-        return img_byte_arr
+def crop_reduced(img, x, y, square_size, max_size):
+    """
+    Crop a square and scale it down to max_size, decoding the image at the smallest
+    scale that still has enough pixels.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 of their size through draft mode, which
+    skips most of the decoding work and memory. Other formats are decoded fully.
+
+    :param img: The opened, not yet loaded, image.
+    :param x: Left of the square in full size pixels.
+    :param y: Top of the square in full size pixels.
+    :param square_size: Side of the square in full size pixels.
+    :param max_size: Side of the resulting crop.
+    :return: The cropped image.
+    """
+    from PIL import Image
+
+    img_width, img_height = img.size
+    scale = max_size / square_size
+
+    # Only changes img.size if the image is a JPEG that can be scaled down enough
+    img.draft(img.mode, (math.ceil(img_width * scale), math.ceil(img_height * scale)))
+    ratio = img.size[0] / img_width
 
+    # The square in the coordinates of the decoded image
+    size = max(1, min(round(square_size * ratio), img.size[0], img.size[1]))
+    left = min(round(x * ratio), img.size[0] - size)
+    top = min(round(y * ratio), img.size[1] - size)
+    square_image = img.crop((left, top, left + size, top + size))
 
-def get_file_path(item=None):
-    global active_game
-    if item == None:
-        if active_game != None:
-            item = active_game["item"]
+    if size > max_size:
+        square_image = square_image.resize((max_size, max_size), Image.LANCZOS)
+
+    return square_image
+
+
+def get_crop_format(image):
+    """
+    Pick the encoding for crops of an image.
+
+    PNG is only worth its encoding time and size for sources with transparency,
+    everything else uses the faster and smaller lossy format.
+
+    :param image: The source image.
+    :return: A Pillow format name.
+    """
+    if image.mode in ("RGBA", "LA", "PA"):
+        return "PNG"
+    if image.mode == "P" and "transparency" in image.info:
+        return "PNG"
+    return crop_lossy_format
+
+
+def encode_image(image, image_format):
+    """
+    Encode an image with settings tuned for encoding speed.
+
+    :param image: The image to encode.
+    :param image_format: "PNG", "JPEG" or "WEBP".
+    :return: A BytesIO object containing the encoded image and its file extension.
+    """
+    img_byte_arr = BytesIO()
+
+    if image_format == "PNG":
+        image.save(img_byte_arr, format="PNG", compress_level=1)
+        file_extension = ".png"
+    else:
+        # The lossy formats don't support palettes, CMYK or transparency
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        if image_format == "WEBP":
+            image.save(img_byte_arr, format="WEBP", quality=crop_quality, method=0)
+            file_extension = ".webp"
         else:
-            return None
+            image.save(img_byte_arr, format="JPEG", quality=crop_quality)
+            file_extension = ".jpg"
+
+    img_byte_arr.seek(0)  # Reset the pointer to the start of the stream
+
+    return img_byte_arr, file_extension
+
 
-    item_id = item["songId"]
-    _, file_extension = os.path.splitext(item["imageName"])
+def get_file_path(item):
+    item_id = item.songId
+    _, file_extension = os.path.splitext(item.imageName)
 
     return f"images/{item_id}{file_extension}"
 
 
+def get_cover_filename(item):
+    # The hash only depends on the song, so compute it once per song
+    filename = cover_filenames.get(item.songId)
+    if filename is None:
+        filename = hash_filename(get_file_path(item))
+        cover_filenames[item.songId] = filename
+
+    return filename
+
+
 def hash_filename(file_path):
     filename = os.path.basename(file_path)
     _, file_extension = os.path.splitext(filename)
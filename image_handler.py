@@ -1,46 +1,300 @@
-from PIL import Image
-import requests
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import asyncio
+import time
+import aiohttp
 import discord
 import os
+from bot import bot, on_close
+from metrics import metrics
 
 IMAGE_URL = "base_images"
 
+# Image composition runs in a worker pool so it never blocks the event loop
+IMAGE_POOL_TYPE = os.getenv("IMAGE_POOL_TYPE", "thread")  # "thread" or "process"
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", 2))
+IMAGE_POOL_QUEUE_SIZE = int(os.getenv("IMAGE_POOL_QUEUE_SIZE", 8))
+
+# Limits for images fetched from users
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", 16 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 25_000_000))
+IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", 15))
+
+# Memory budget for the resized base image variants
+BASE_IMAGE_CACHE_BYTES = int(os.getenv("BASE_IMAGE_CACHE_BYTES", 128 * 1024 * 1024))
+
+# Seconds between checks for changes in IMAGE_URL, 0 disables them
+TEMPLATE_POLL_INTERVAL = float(os.getenv("TEMPLATE_POLL_INTERVAL", 30))
+
+
+class ImagePoolBusyError(Exception):
+    """
+    Raised when the image worker pool already has too many jobs waiting.
+    """
+
+
+class ImageWorkerPool:
+    """
+    A thread or process pool with a bounded number of pending jobs.
+
+    Args:
+        pool_type (str): "thread" or "process".
+        max_workers (int): The number of workers running jobs.
+        queue_size (int): How many jobs may wait for a free worker.
+    """
+
+    def __init__(self, pool_type, max_workers, queue_size):
+        if pool_type == "process":
+            # Forking would copy the threads of the bot mid-flight, start the workers
+            # from a clean process instead
+            start_method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            # Every process has its own base image cache, fill it as it starts
+            self.executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=preload_base_images,
+            )
+            # Workers start on demand, start them all now so they are ready in time
+            for _ in range(max_workers):
+                self.executor.submit(int)
+        elif pool_type == "thread":
+            self.executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="image_worker"
+            )
+            # The threads share this process' cache, fill it in the background
+            self.executor.submit(preload_base_images)
+        else:
+            raise ValueError(f"Unknown image pool type: {pool_type}")
+
+        self.max_pending = max_workers + queue_size
+        self.pending = 0
+
+    @contextmanager
+    def reserve(self):
+        """
+        Hold a slot in the pool, so work done before submitting a job is not wasted
+        on a busy pool.
+
+        Raises:
+            ImagePoolBusyError: If the pool can't accept another job right now.
+        """
+        # Only the event loop reserves slots, so a plain counter is enough
+        if self.pending >= self.max_pending:
+            raise ImagePoolBusyError()
+
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    async def submit(self, func, *args):
+        """
+        Run func(*args) in the pool and wait for its result, call it within reserve().
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+
+class BaseImageCache:
+    """
+    Decoded base images and their resized variants, shared by the image workers.
+
+    Each base image is decoded once and kept, resized variants are kept in an LRU
+    within the memory budget. Cached images are shared, so callers must not modify them.
+
+    Args:
+        max_bytes (int): The memory budget for the resized variants.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.images = {}
+        self.variants = OrderedDict()
+        self.variants_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, version=None):
+        """
+        Get the decoded RGBA base image at path.
+
+        Args:
+            path (str): The file path of the base image.
+            version: Identifies the file contents, a different version reloads the image.
+        """
+        with self.lock:
+            cached = self.images.get(path)
+
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        # convert() fully decodes the image
+        image = open_image(path).convert("RGBA")
+
+        with self.lock:
+            self.images[path] = (version, image)
+
+            # Variants of an older version will never be used again
+            for key in [key for key in self.variants if key[0] == path]:
+                if key[1] != version:
+                    self.variants_bytes -= get_image_bytes(self.variants.pop(key))
+
+        return image
+
+    def get_resized(self, path, size, version=None):
+        """
+        Get the base image at path resized to size with LANCZOS.
+        """
+        key = (path, version, size)
+        with self.lock:
+            image = self.variants.get(key)
+            if image is not None:
+                self.variants.move_to_end(key)
+                return image
+
+        from PIL import Image
+
+        image = self.get(path, version).resize(size, Image.LANCZOS)
+        image_bytes = get_image_bytes(image)
+
+        with self.lock:
+            if key not in self.variants and image_bytes <= self.max_bytes:
+                self.variants[key] = image
+                self.variants_bytes += image_bytes
+
+                # Drop the least recently used variants until we are within budget
+                while self.variants_bytes > self.max_bytes:
+                    _, old_image = self.variants.popitem(last=False)
+                    self.variants_bytes -= get_image_bytes(old_image)
+
+        return image
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.variants.clear()
+            self.variants_bytes = 0
+
+
+def get_image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+base_image_cache = BaseImageCache(BASE_IMAGE_CACHE_BYTES)
+
+
+def preload_base_images():
+    # Decode every base image ahead of time
+    for template in template_registry.templates:
+        base_image_cache.get(template.path, template.version)
+
+
+class ImageFetchError(Exception):
+    """
+    Raised when a user image can't be fetched or is not acceptable.
+    """
+
+
+image_pool = None
+http_session = None
+
+
+def get_image_pool():
+    global image_pool
+    if image_pool is None:
+        image_pool = ImageWorkerPool(
+            IMAGE_POOL_TYPE, IMAGE_POOL_WORKERS, IMAGE_POOL_QUEUE_SIZE
+        )
+    return image_pool
+
+
+def get_http_session():
+    # Shared so image fetches reuse pooled connections
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=IMAGE_FETCH_TIMEOUT)
+        )
+    return http_session
+
+
+@on_close
+async def close_http_session():
+    # Otherwise aiohttp warns about an unclosed session on every shutdown
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+
+
+metrics.gauge("image_pool_pending", lambda: image_pool.pending if image_pool else 0)
+
 
 class ImageSelectionView(discord.ui.View):
     def __init__(self, user_image_url):
         super().__init__()
         self.user_image_url = user_image_url
 
-        # Read all base image names in the directory
-        self.base_images = [
-            f for f in os.listdir(IMAGE_URL) if f.endswith((".png", ".jpg", ".jpeg"))
-        ]
-
         # Create a button for each base image
-        for img in self.base_images:
+        for template in template_registry.templates:
             button = discord.ui.Button(
-                label=get_file_name(img),
+                label=template.name,
                 style=discord.ButtonStyle.primary,
             )
 
-            async def button_callback(interaction, img=img):
-                is_base_bg, location, size = parse_filename(img)
-
-                image_io = create_image(
-                    is_base_bg,
-                    os.path.join(IMAGE_URL, img),
-                    self.user_image_url,
-                    location,
-                    size,
+            async def button_callback(interaction, template=template):
+                # Discord only waits 3 seconds for a response, fetching and composing
+                # can take longer, so acknowledge first and answer with followups
+                await interaction.response.defer()
+
+                pool = get_image_pool()
+                try:
+                    # Take the slot before fetching, a busy pool would waste the download
+                    with pool.reserve():
+                        user_image = await fetch_image(self.user_image_url)
+
+                        start = time.perf_counter()
+                        image_io = await pool.submit(
+                            create_image,
+                            template.is_base_bg,
+                            template.path,
+                            user_image,
+                            template.position,
+                            template.size,
+                            template.version,
+                        )
+                except ImageFetchError as e:
+                    await interaction.followup.send(str(e), ephemeral=True)
+                    return
+                except ImagePoolBusyError:
+                    await interaction.followup.send(
+                        "The bot is busy creating other images, please try again in a moment.",
+                        ephemeral=True,
+                    )
+                    return
+
+                # Includes the wait for a free worker, create_image may run in another process
+                metrics.observe(
+                    "create_image_seconds",
+                    time.perf_counter() - start,
+                    template=template.name,
+                )
+                metrics.inc(
+                    "bytes_uploaded_total",
+                    image_io.getbuffer().nbytes,
+                    image="composite",
                 )
 
                 await interaction.message.edit(
                     content="",
                     attachments=[
-                        discord.File(
-                            image_io, filename=f"{get_file_name(img)}_result.png"
-                        )
+                        discord.File(image_io, filename=f"{template.name}_result.png")
                     ],
                     view=None,
                 )
@@ -49,23 +303,90 @@ class ImageSelectionView(discord.ui.View):
             self.add_item(button)
 
 
+def list_base_images(directory):
+    return [f for f in os.listdir(directory) if f.endswith((".png", ".jpg", ".jpeg"))]
+
+
 def get_file_name(file):
     return os.path.splitext(os.path.basename(file))[0].split("_")[0]
 
 
+async def fetch_image(url):
+    """
+    Download an image without blocking the event loop.
+
+    The body is streamed with a hard size cap and the image dimensions are read
+    from its header, so oversized images are rejected before being decoded.
+
+    Args:
+        url (str): The URL of the image.
+
+    Returns:
+        bytes: The encoded image.
+
+    Raises:
+        ImageFetchError: If the image can't be downloaded or is too large.
+    """
+    try:
+        async with get_http_session().get(url) as response:
+            if response.status != 200:
+                raise ImageFetchError(
+                    f"Failed to download the image (status {response.status})."
+                )
+
+            # Reject early when the server tells us the size
+            if (
+                response.content_length is not None
+                and response.content_length > MAX_IMAGE_BYTES
+            ):
+                raise ImageFetchError("The image file is too large.")
+
+            buffer = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                buffer.extend(chunk)
+                if len(buffer) > MAX_IMAGE_BYTES:
+                    raise ImageFetchError("The image file is too large.")
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        raise ImageFetchError("Failed to download the image.")
+
+    data = bytes(buffer)
+
+    from PIL import Image
+
+    # Image.open only parses the header, nothing is decoded yet
+    try:
+        with Image.open(BytesIO(data)) as image:
+            width, height = image.size
+    except Exception:
+        raise ImageFetchError("Please upload a valid image file.")
+
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageFetchError("The image dimensions are too large.")
+
+    return data
+
+
 def open_image(source):
     """
-    Open an image from a local file or a URL.
+    Open an image from a local file, a URL or already downloaded bytes.
 
     Args:
-        source (str): The file path of the local image or the URL of the image.
+        source (str | bytes): The file path of the local image, the URL of the image or the encoded image.
 
     Returns:
         Image: An Image object opened from the specified source.
     """
-    if source.startswith("http://") or source.startswith("https://"):
+    # Pillow and requests are imported on first use to keep startup fast
+    from PIL import Image
+
+    if isinstance(source, (bytes, bytearray)):
+        # It's an already downloaded image
+        image = Image.open(BytesIO(source))
+    elif source.startswith("http://") or source.startswith("https://"):
         # It's a URL, download the image
-        response = requests.get(source)
+        import requests
+
+        response = requests.get(source, timeout=IMAGE_FETCH_TIMEOUT)
         response.raise_for_status()  # Raise an error for bad responses
         image = Image.open(BytesIO(response.content))
     else:
@@ -100,9 +421,13 @@ def parse_filename(filename):
         return is_base_bg, None, None
 
 
-def create_image(is_base_bg, base_img_src, user_img_src, position, size):
+def create_image(
+    is_base_bg, base_img_src, user_img_src, position, size, base_img_version=None
+):
+    from PIL import Image
+
     if is_base_bg:
-        bg_img = open_image(base_img_src).convert("RGBA")
+        bg_img = base_image_cache.get(base_img_src, base_img_version)
         fg_img = open_image(user_img_src).convert("RGBA")
 
         # Determine the smaller width between background and foreground
@@ -113,7 +438,9 @@ def create_image(is_base_bg, base_img_src, user_img_src, position, size):
         result_height = int(result_width * bg_aspect_ratio)
 
         # Resize the background image
-        bg_img = bg_img.resize((result_width, result_height), Image.LANCZOS)
+        bg_img = base_image_cache.get_resized(
+            base_img_src, (result_width, result_height), base_img_version
+        )
 
         # Calculate target dimensions for the foreground based on allocated size
         target_width = int(result_width * size[0])
@@ -150,13 +477,15 @@ def create_image(is_base_bg, base_img_src, user_img_src, position, size):
         paste_y = int(result_height * position[1])
     else:
         bg_img = open_image(user_img_src)
-        fg_img = open_image(base_img_src)
+        fg_img = base_image_cache.get(base_img_src, base_img_version)
 
         result_width = bg_img.width
         result_height = bg_img.height
 
         fg_new_height = int(bg_img.width / fg_img.width * fg_img.height)
-        fg_img = fg_img.resize((bg_img.width, fg_new_height), Image.LANCZOS)
+        fg_img = base_image_cache.get_resized(
+            base_img_src, (bg_img.width, fg_new_height), base_img_version
+        )
 
         paste_x = 0
         paste_y = 0
@@ -174,3 +503,100 @@ def create_image(is_base_bg, base_img_src, user_img_src, position, size):
     result_image_io.seek(0)
 
     return result_image_io
+
+
+class BaseTemplate:
+    """
+    A base image from IMAGE_URL with its parsed parameters.
+    """
+
+    __slots__ = (
+        "filename",
+        "path",
+        "name",
+        "version",
+        "is_base_bg",
+        "position",
+        "size",
+    )
+
+    def __init__(self, filename, path, version):
+        self.filename = filename
+        self.path = path
+        self.name = get_file_name(filename)
+        self.version = version
+        self.is_base_bg, self.position, self.size = parse_filename(filename)
+
+
+class TemplateRegistry:
+    """
+    The base images available to ImageSelectionView, rescanned only when the directory changes.
+
+    Args:
+        directory (str): The directory containing the base images.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.templates = []
+        self.mtimes = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rescan the directory if any base image was added, removed or modified.
+
+        Returns:
+            bool: True if the templates changed.
+        """
+        mtimes = {
+            f: os.stat(os.path.join(self.directory, f)).st_mtime_ns
+            for f in list_base_images(self.directory)
+        }
+        if mtimes == self.mtimes:
+            return False
+
+        templates = []
+        for filename in sorted(mtimes):
+            try:
+                template = BaseTemplate(
+                    filename, os.path.join(self.directory, filename), mtimes[filename]
+                )
+            except (IndexError, ValueError):
+                print(f"Skipping base image with an invalid name: {filename}")
+                continue
+            templates.append(template)
+
+        # Swap the whole list so views never see a half built registry
+        self.templates = templates
+        self.mtimes = mtimes
+        return True
+
+
+template_registry = TemplateRegistry(IMAGE_URL)
+template_poll_task = None
+
+
+async def poll_templates():
+    while True:
+        await asyncio.sleep(TEMPLATE_POLL_INTERVAL)
+        try:
+            if await asyncio.to_thread(template_registry.refresh):
+                print("Base images reloaded")
+        except OSError as e:
+            print(f"Failed to rescan base images: {e}")
+
+
+@bot.listen("on_ready")
+async def start_template_polling():
+    # on_ready fires again after reconnects, only start polling once
+    global template_poll_task
+    if template_poll_task is None and TEMPLATE_POLL_INTERVAL > 0:
+        template_poll_task = asyncio.create_task(poll_templates())
+
+
+@bot.listen("on_ready")
+async def start_image_pool():
+    # Create the pool before the first click so its base images are already decoded
+    # by then, creating it again after a reconnect does nothing
+    get_image_pool()
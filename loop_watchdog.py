@@ -0,0 +1,113 @@
+import traceback
+import threading
+import inspect
+import asyncio
+import time
+import sys
+import os
+from metrics import metrics
+
+# Report callbacks blocking the event loop for longer than this many seconds, 0 disables the watchdog
+loop_watchdog_threshold = float(os.getenv("LOOP_WATCHDOG_THRESHOLD", 0))
+
+# Seconds between heartbeats of the event loop
+loop_watchdog_interval = float(os.getenv("LOOP_WATCHDOG_INTERVAL", 0.05))
+
+
+class LoopWatchdog:
+    """
+    Detects callbacks blocking the event loop.
+
+    A task on the loop records a heartbeat every interval. A separate thread checks
+    the heartbeat, and when it is older than the threshold it samples the stack of
+    the loop's thread, so the report shows what is blocking while it still blocks.
+
+    :param threshold: Seconds the loop may be blocked before it is reported.
+    :param interval: Seconds between heartbeats and checks.
+    """
+
+    def __init__(self, threshold, interval):
+        self.threshold = threshold
+        self.interval = interval
+        self.loop = None
+        self.loop_thread_id = None
+        self.last_beat = time.monotonic()
+        self.beat_count = 0
+        self.reported_beat = None
+        self.max_lag = 0.0
+
+    def start(self):
+        """
+        Start watching the running event loop. Must run on the event loop.
+        """
+        # on_ready fires again after reconnects, only start once
+        if self.threshold <= 0 or self.loop is not None:
+            return
+
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.loop.create_task(self.beat(), name="loop_watchdog")
+        threading.Thread(target=self.watch, name="loop_watchdog", daemon=True).start()
+        print(f"Watching the event loop for stalls over {self.threshold * 1000:.0f} ms")
+
+    async def beat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_beat = time.monotonic()
+            self.beat_count += 1
+
+            # How much later than asked the sleep ended
+            lag = self.last_beat - start - self.interval
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe("event_loop_lag_seconds", lag)
+
+            if lag > self.threshold:
+                print(f"Event loop was blocked for {lag * 1000:.0f} ms")
+
+    def watch(self):
+        while True:
+            time.sleep(self.interval)
+
+            beat_count = self.beat_count
+            blocked = time.monotonic() - self.last_beat - self.interval
+            # Sample every stall once, while it is still happening
+            if blocked > self.threshold and self.reported_beat != beat_count:
+                self.reported_beat = beat_count
+                self.report(blocked)
+
+    def report(self, blocked):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+
+        stack = traceback.extract_stack(frame)
+        print(
+            f"Event loop blocked for over {blocked * 1000:.0f} ms"
+            f" in {self.get_handler_name(frame)}, stack sample:\n"
+            + "".join(stack.format())
+        )
+
+    def get_handler_name(self, frame):
+        """
+        Name the task or coroutine running on the loop, discord.py names its event
+        handler tasks after the event.
+        """
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return f"task '{task.get_name()}' ({task.get_coro().__qualname__})"
+
+        # Not inside a task, name the outermost coroutine on the stack instead
+        name = None
+        while frame is not None:
+            if frame.f_code.co_flags & inspect.CO_COROUTINE:
+                name = f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+            frame = frame.f_back
+        return f"coroutine {name}" if name else "a plain callback"
+
+
+loop_watchdog = LoopWatchdog(loop_watchdog_threshold, loop_watchdog_interval)
@@ -1,15 +1,49 @@
+from startup_timing import startup_timer
 import os
 import dotenv
-import discord
-from discord.ext import commands
-from image_handler import ImageSelectionView
-from guess_image import init_game
-from bot import bot
 
+# Load the environment before the other modules read their settings from it
 dotenv.load_dotenv()
 
+# Split the shards across this many processes, each running this script
+shard_processes = int(os.getenv("SHARD_PROCESSES", 1))
+
+# Image worker processes import this script too, they must not launch or run anything
+if __name__ == "__main__" and shard_processes > 1:
+    # Only the shard processes need the bot, so launch them before importing it
+    from shard_launcher import launch_shards
+
+    shard_count = os.getenv("SHARD_COUNT", "")
+    if not shard_count.isdigit() or int(shard_count) < 1:
+        raise SystemExit(
+            "SHARD_COUNT must be set to a positive number to use SHARD_PROCESSES"
+        )
+
+    raise SystemExit(
+        launch_shards(os.path.abspath(__file__), int(shard_count), shard_processes)
+    )
+
+with startup_timer.measure("import discord"):
+    import discord
+    from discord import app_commands
+    from discord.ext import commands
+with startup_timer.measure("import image_handler"):
+    from image_handler import ImageSelectionView
+with startup_timer.measure("import guess_image"):
+    from guess_image import (
+        init_game,
+        send_song_message,
+        send_leaderboard_message,
+        autocomplete_songs,
+    )
+from bot import bot
+from metrics import metrics
+from loop_watchdog import loop_watchdog
+
 token = os.getenv("DISCORD_BOT_TOKEN")
 
+metrics.instrument_commands(bot)
+
 
 @bot.command()
 @commands.has_permissions(administrator=True)
@@ -55,4 +89,35 @@ async def guess(ctx):
     await init_game(ctx)
 
 
-bot.run(token)
+@bot.hybrid_command()
+async def song(ctx, *, query: str):
+    """Look up a song"""
+    await send_song_message(ctx, query)
+
+
+@song.autocomplete("query")
+async def song_autocomplete(interaction, current):
+    # Choice names and values are limited to 100 characters
+    return [
+        app_commands.Choice(name=title[:100], value=song_id[:100])
+        for title, song_id in autocomplete_songs(current)
+    ]
+
+
+@bot.hybrid_command()
+async def leaderboard(ctx):
+    """Show who guessed the most songs"""
+    await send_leaderboard_message(ctx)
+
+
+@bot.listen("on_ready")
+async def report_startup():
+    startup_timer.mark("gateway ready")
+    startup_timer.report()
+    await metrics.start()
+    loop_watchdog.start()
+
+
+if __name__ == "__main__":
+    startup_timer.mark("connecting")
+    bot.run(token)
@@ -0,0 +1,303 @@
+from bisect import bisect_left
+from functools import wraps
+import inspect
+import threading
+import asyncio
+import time
+import os
+
+# Serve the metrics in the Prometheus text format on this port, 0 disables the endpoint
+metrics_port = int(os.getenv("METRICS_PORT", 0))
+metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Seconds between metric dumps to the log, 0 disables them
+metrics_log_interval = float(os.getenv("METRICS_LOG_INTERVAL", 0))
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """
+    Counts of observations per bucket, like a Prometheus histogram.
+
+    :param buckets: The sorted upper bounds of the buckets.
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last count is for observations above every bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+
+        :return: The bound, inf if it is above every bound, or None without observations.
+        """
+        if self.count == 0:
+            return None
+
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Counters, histograms and gauges of the bot, exposed over HTTP or dumped to the log.
+
+    When disabled every update returns right away and timed leaves functions
+    undecorated, so the instrumentation costs next to nothing.
+
+    :param enabled: Whether to record anything.
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.started = False
+
+        # Counter values at the previous log dump, for the rates
+        self.last_dump = {}
+        self.last_dump_time = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(value)
+
+    def gauge(self, name, func):
+        """
+        Register a gauge, func is only called when the metrics are read.
+        """
+        self.gauges[name] = func
+
+    def timed(self, name, **labels):
+        """
+        Decorator recording the duration of every call of a function or coroutine
+        function in the histogram name.
+        """
+
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            if inspect.iscoroutinefunction(func):
+
+                @wraps(func)
+                async def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(name, time.perf_counter() - start, **labels)
+
+            else:
+
+                @wraps(func)
+                def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return func(*args, **kwargs)
+                    finally:
+                        self.observe(name, time.perf_counter() - start, **labels)
+
+            return wrapper
+
+        return decorator
+
+    def instrument_commands(self, bot):
+        """
+        Record the latency of every command invocation of bot by command name.
+        """
+        if not self.enabled:
+            return
+
+        @bot.before_invoke
+        async def start_command_timer(ctx):
+            ctx.metrics_start = time.perf_counter()
+
+        @bot.after_invoke
+        async def stop_command_timer(ctx):
+            start = getattr(ctx, "metrics_start", None)
+            if start is not None:
+                self.observe(
+                    "command_latency_seconds",
+                    time.perf_counter() - start,
+                    command=ctx.command.qualified_name,
+                )
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: (
+                    tuple(h.counts),
+                    h.count,
+                    h.sum,
+                    h.quantile(0.5),
+                    h.quantile(0.95),
+                )
+                for key, h in self.histograms.items()
+            }
+
+        gauges = {}
+        for name, func in self.gauges.items():
+            try:
+                gauges[name] = func()
+            except Exception as e:
+                print(f"Failed to read the gauge {name}: {e}")
+
+        return counters, histograms, gauges
+
+    def render(self):
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        counters, histograms, gauges = self.snapshot()
+        lines = []
+        typed = set()
+
+        def declare(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for name, value in sorted(gauges.items()):
+            declare(name, "gauge")
+            lines.append(f"{name} {value}")
+
+        for (name, labels), (counts, count, total, _, _) in sorted(histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (("le", str(bound)),)
+                lines.append(
+                    f"{name}_bucket{format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        """
+        Print the metrics, with the counters as rates since the previous dump.
+        """
+        counters, histograms, gauges = self.snapshot()
+        now = time.monotonic()
+        elapsed = max(now - self.last_dump_time, 1e-9)
+
+        print("Metrics:")
+        for name, value in sorted(gauges.items()):
+            print(f"  {name:<48}{value:>12}")
+        for (name, labels), value in sorted(counters.items()):
+            rate = (value - self.last_dump.get((name, labels), 0)) / elapsed
+            print(f"  {name + format_labels(labels):<48}{value:>12}{rate:>10.2f}/s")
+        for (name, labels), (_, count, total, p50, p95) in sorted(histograms.items()):
+            print(
+                f"  {name + format_labels(labels):<48}{count:>12}"
+                f"  mean {total / count * 1000:.1f} ms"
+                f"  p50 <= {p50 * 1000:.1f} ms  p95 <= {p95 * 1000:.1f} ms"
+            )
+
+        self.last_dump = counters
+        self.last_dump_time = now
+
+    async def start(self):
+        """
+        Start the HTTP endpoint and the log dumps that are configured. Must run on the event loop.
+        """
+        # on_ready fires again after reconnects, only start once
+        if not self.enabled or self.started:
+            return
+        self.started = True
+
+        if metrics_port > 0:
+            from aiohttp import web
+
+            async def handle_metrics(request):
+                return web.Response(text=self.render())
+
+            app = web.Application()
+            app.router.add_get("/metrics", handle_metrics)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, metrics_host, metrics_port).start()
+            print(f"Serving metrics on http://{metrics_host}:{metrics_port}/metrics")
+
+        if metrics_log_interval > 0:
+            asyncio.create_task(self.dump_periodically())
+
+    async def dump_periodically(self):
+        while True:
+            await asyncio.sleep(metrics_log_interval)
+            self.dump()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels)
+        + "}"
+    )
+
+
+def escape_label_value(value):
+    # The text format only allows these escapes in label values
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics(metrics_port > 0 or metrics_log_interval > 0)
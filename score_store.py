@@ -0,0 +1,291 @@
+from collections import Counter
+import threading
+import sqlite3
+import atexit
+import heapq
+import queue
+import time
+
+# How many finished games are written in one transaction at most
+FLUSH_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    played_at REAL NOT NULL,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    song_id TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    winner_id INTEGER,
+    solve_seconds REAL
+);
+CREATE TABLE IF NOT EXISTS player_scores (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS song_stats (
+    song_id TEXT PRIMARY KEY,
+    played INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    timed_out INTEGER NOT NULL,
+    solve_seconds REAL NOT NULL
+);
+"""
+
+
+class SongStats:
+    __slots__ = ("played", "correct", "skipped", "timed_out", "solve_seconds")
+
+    def __init__(self, played=0, correct=0, skipped=0, timed_out=0, solve_seconds=0.0):
+        self.played = played
+        self.correct = correct
+        self.skipped = skipped
+        self.timed_out = timed_out
+        self.solve_seconds = solve_seconds
+
+    def add(self, outcome, solve_seconds):
+        self.played += 1
+        if outcome == "correct":
+            self.correct += 1
+            self.solve_seconds += solve_seconds
+        elif outcome == "skipped":
+            self.skipped += 1
+        else:
+            self.timed_out += 1
+
+
+class ScoreStore:
+    """
+    Wins per player and statistics per song, kept in memory and written behind to SQLite.
+
+    Recording a game only updates the in-memory aggregates and queues the game, a
+    background thread writes the queued games in batches. Queries only read the
+    in-memory aggregates, so nothing on the event loop waits for the database.
+
+    :param path: The SQLite database file.
+    :param flush_interval: Seconds the writer waits to collect a batch, must be positive.
+    """
+
+    def __init__(self, path, flush_interval):
+        # The writer blocks for up to flush_interval, without a wait it would spin
+        if flush_interval <= 0:
+            raise ValueError(
+                f"The score flush interval must be positive, got {flush_interval}"
+            )
+
+        self.path = path
+        self.flush_interval = flush_interval
+
+        # wins[guild_id][user_id]
+        self.wins = {}
+        self.song_stats = {}
+        self.lock = threading.Lock()
+        # Held while opening, so a second open() can't merge the totals twice
+        self.open_lock = threading.Lock()
+
+        self.pending = queue.SimpleQueue()
+        self.writer = None
+        self.stopping = threading.Event()
+
+    def open(self):
+        """
+        Create the database if needed, load the aggregates and start the writer.
+
+        Blocks, so call it from a worker thread when on the event loop. Opening again,
+        as on_ready does after a reconnect, does nothing.
+        """
+        with self.open_lock:
+            if self.writer is not None:
+                return
+
+            # Shard processes share the database, wait for each other's transactions
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # WAL lets the reads of other tools run alongside the writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+
+            player_rows = connection.execute(
+                "SELECT guild_id, user_id, wins FROM player_scores"
+            ).fetchall()
+            song_rows = connection.execute(
+                "SELECT song_id, played, correct, skipped, timed_out, solve_seconds FROM song_stats"
+            ).fetchall()
+
+            # Games recorded before opening are still queued, add the stored totals to them
+            with self.lock:
+                for guild_id, user_id, wins in player_rows:
+                    guild_wins = self.wins.setdefault(guild_id, {})
+                    guild_wins[user_id] = guild_wins.get(user_id, 0) + wins
+                for song_id, *values in song_rows:
+                    stats = self.song_stats.setdefault(song_id, SongStats())
+                    stats.played += values[0]
+                    stats.correct += values[1]
+                    stats.skipped += values[2]
+                    stats.timed_out += values[3]
+                    stats.solve_seconds += values[4]
+
+            self.writer = threading.Thread(
+                target=self.write_behind,
+                args=(connection,),
+                name="score_writer",
+                daemon=True,
+            )
+            self.writer.start()
+            atexit.register(self.close)
+            print(f"Loaded the scores of {len(song_rows)} songs from '{self.path}'")
+
+    def record_game(
+        self, guild_id, channel_id, song_id, outcome, winner_id=None, solve_seconds=None
+    ):
+        """
+        Record a finished game, never blocks.
+
+        :param outcome: "correct", "skipped" or "timeout".
+        :param winner_id: The user who guessed correctly.
+        :param solve_seconds: How long the winner took.
+        """
+        with self.lock:
+            if winner_id is not None:
+                guild_wins = self.wins.setdefault(guild_id, {})
+                guild_wins[winner_id] = guild_wins.get(winner_id, 0) + 1
+            self.song_stats.setdefault(song_id, SongStats()).add(
+                outcome, solve_seconds or 0.0
+            )
+
+        self.pending.put(
+            (
+                time.time(),
+                guild_id,
+                channel_id,
+                song_id,
+                outcome,
+                winner_id,
+                solve_seconds,
+            )
+        )
+
+    def get_leaderboard(self, guild_id, limit=10):
+        """
+        :return: A list of (user_id, wins) of the players with the most wins in the guild.
+        """
+        with self.lock:
+            guild_wins = self.wins.get(guild_id)
+            if not guild_wins:
+                return []
+            return heapq.nlargest(limit, guild_wins.items(), key=lambda item: item[1])
+
+    def get_song_stats(self, song_id):
+        """
+        :return: The SongStats of the song, or None if it has never been played.
+        """
+        with self.lock:
+            stats = self.song_stats.get(song_id)
+            if stats is None:
+                return None
+            return SongStats(
+                stats.played,
+                stats.correct,
+                stats.skipped,
+                stats.timed_out,
+                stats.solve_seconds,
+            )
+
+    def write_behind(self, connection):
+        while not self.stopping.is_set():
+            batch = self.take_batch(self.flush_interval)
+            if batch:
+                self.write_batch(connection, batch)
+
+        # Write whatever is left before closing
+        while batch := self.take_batch(0):
+            self.write_batch(connection, batch)
+        connection.close()
+
+    def take_batch(self, timeout):
+        try:
+            batch = [
+                (
+                    self.pending.get(timeout=timeout)
+                    if timeout
+                    else self.pending.get_nowait()
+                )
+            ]
+        except queue.Empty:
+            return []
+
+        # Give more games a moment to arrive so they share the transaction
+        deadline = time.monotonic() + timeout
+        while len(batch) < FLUSH_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(
+                    self.pending.get(timeout=remaining)
+                    if remaining > 0
+                    else self.pending.get_nowait()
+                )
+            except queue.Empty:
+                break
+
+        return batch
+
+    def write_batch(self, connection, batch):
+        # Sum the batch first so every player and song is only updated once
+        wins = Counter()
+        song_totals = {}
+        for _, guild_id, _, song_id, outcome, winner_id, solve_seconds in batch:
+            if winner_id is not None:
+                wins[(guild_id, winner_id)] += 1
+            song_totals.setdefault(song_id, SongStats()).add(
+                outcome, solve_seconds or 0.0
+            )
+
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO games (played_at, guild_id, channel_id, song_id, outcome, winner_id, solve_seconds)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+                connection.executemany(
+                    "INSERT INTO player_scores (guild_id, user_id, wins) VALUES (?, ?, ?)"
+                    " ON CONFLICT (guild_id, user_id) DO UPDATE SET wins = wins + excluded.wins",
+                    [(guild_id, user_id, n) for (guild_id, user_id), n in wins.items()],
+                )
+                connection.executemany(
+                    "INSERT INTO song_stats (song_id, played, correct, skipped, timed_out, solve_seconds)"
+                    " VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (song_id) DO UPDATE SET"
+                    " played = played + excluded.played,"
+                    " correct = correct + excluded.correct,"
+                    " skipped = skipped + excluded.skipped,"
+                    " timed_out = timed_out + excluded.timed_out,"
+                    " solve_seconds = solve_seconds + excluded.solve_seconds",
+                    [
+                        (
+                            song_id,
+                            stats.played,
+                            stats.correct,
+                            stats.skipped,
+                            stats.timed_out,
+                            stats.solve_seconds,
+                        )
+                        for song_id, stats in song_totals.items()
+                    ],
+                )
+        except sqlite3.Error as e:
+            # The in-memory aggregates still count these games until the next restart
+            print(f"Failed to write {len(batch)} games to '{self.path}': {e}")
+
+    def close(self):
+        """
+        Write the queued games and stop the writer.
+        """
+        if self.writer is None or self.stopping.is_set():
+            return
+        self.stopping.set()
+        self.writer.join()
@@ -0,0 +1,119 @@
+import subprocess
+import signal
+import time
+import sys
+import os
+
+# Seconds to wait before restarting a shard process that exited, doubled after
+# every exit in a row up to max_restart_delay
+restart_delay = float(os.getenv("SHARD_RESTART_DELAY", 5))
+max_restart_delay = float(os.getenv("SHARD_MAX_RESTART_DELAY", 300))
+
+# A process that ran this many seconds before exiting restarts after restart_delay again
+stable_after = 60
+
+
+def split_shards(shard_count, processes):
+    """
+    Split the shards into contiguous ranges of about equal size.
+
+    :return: A list of (first, last) inclusive shard ranges, one per process.
+    """
+    processes = min(processes, shard_count)
+    ranges = []
+    first = 0
+    for i in range(processes):
+        size = shard_count // processes + (1 if i < shard_count % processes else 0)
+        ranges.append((first, first + size - 1))
+        first += size
+    return ranges
+
+
+def get_shard_env(index, shard_range, shard_count):
+    env = os.environ.copy()
+    env["SHARD_COUNT"] = str(shard_count)
+    env["SHARD_IDS"] = f"{shard_range[0]}-{shard_range[1]}"
+    # The shard processes run the bot themselves instead of launching more processes
+    env["SHARD_PROCESSES"] = "1"
+
+    # Every process serves its own metrics, give them consecutive ports
+    metrics_port = int(env.get("METRICS_PORT", 0))
+    if metrics_port > 0:
+        env["METRICS_PORT"] = str(metrics_port + index)
+
+    return env
+
+
+def launch_shards(script, shard_count, processes):
+    """
+    Run script in one process per shard range and restart the processes that exit,
+    until the launcher is interrupted or terminated.
+
+    Restarts are scheduled per process, so one process crashing in a loop backs off
+    without delaying the monitoring of the others.
+
+    The processes share the song catalog and the covers through the OS page cache,
+    the bot state of each one only holds the guilds of its shards.
+
+    :param script: The bot script, run with SHARD_COUNT and SHARD_IDS set.
+    :param shard_count: The total number of shards.
+    :param processes: How many processes to split the shards across.
+    :return: The exit code of the launcher.
+    """
+    ranges = split_shards(shard_count, processes)
+    children = {}
+    started_at = {}
+    # Exits in a row of every process, and when the exited ones are due to restart
+    failures = {index: 0 for index in range(len(ranges))}
+    restart_at = {}
+
+    def start(index):
+        shard_range = ranges[index]
+        print(f"Starting shards {shard_range[0]}-{shard_range[1]} of {shard_count}")
+        children[index] = subprocess.Popen(
+            [sys.executable, script], env=get_shard_env(index, shard_range, shard_count)
+        )
+        started_at[index] = time.monotonic()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        for index in range(len(ranges)):
+            start(index)
+
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            for index, child in list(children.items()):
+                if index in restart_at:
+                    if now >= restart_at[index]:
+                        del restart_at[index]
+                        start(index)
+                    continue
+
+                if child.poll() is not None:
+                    if now - started_at[index] >= stable_after:
+                        failures[index] = 0
+                    delay = min(restart_delay * 2 ** failures[index], max_restart_delay)
+                    failures[index] += 1
+                    restart_at[index] = now + delay
+                    print(
+                        f"Shard process {index} exited with code {child.returncode},"
+                        f" restarting in {delay:.0f} s"
+                    )
+    except KeyboardInterrupt:
+        print("Stopping the shard processes")
+    finally:
+        for child in children.values():
+            if child.poll() is None:
+                child.terminate()
+        for child in children.values():
+            try:
+                child.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                child.kill()
+
+    return 0
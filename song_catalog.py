@@ -0,0 +1,125 @@
+import os
+import json
+import pickle
+from atomic_file import atomic_write
+
+# The full song data written by generate_full_song_data.py
+song_data_file = "full_song_data.json"
+
+# The compact catalog the bot loads, only holding the fields it uses
+song_catalog_file = "song_catalog.pickle"
+
+# Bump when SONG_FIELDS changes so old catalogs are ignored
+CATALOG_VERSION = 1
+
+SONG_FIELDS = (
+    "songId",
+    "title",
+    "reading",
+    "romonizedTitle",
+    "fullRomonizedTitle",
+    "aliases",
+    "artist",
+    "category",
+    "imageName",
+)
+
+
+class Song:
+    """
+    A song as used by the bot, the fields are named like in full_song_data.json.
+    """
+
+    __slots__ = SONG_FIELDS
+
+    def __init__(
+        self,
+        songId,
+        title,
+        reading,
+        romonizedTitle,
+        fullRomonizedTitle,
+        aliases,
+        artist,
+        category,
+        imageName,
+    ):
+        self.songId = songId
+        self.title = title
+        self.reading = reading
+        self.romonizedTitle = romonizedTitle
+        self.fullRomonizedTitle = fullRomonizedTitle
+        self.aliases = aliases
+        self.artist = artist
+        self.category = category
+        self.imageName = imageName
+
+    @classmethod
+    def from_dict(cls, item):
+        return cls(
+            item["songId"],
+            item["title"],
+            item.get("reading"),
+            item.get("romonizedTitle"),
+            item.get("fullRomonizedTitle"),
+            tuple(item.get("aliases") or ()),
+            item.get("artist"),
+            item.get("category"),
+            item.get("imageName"),
+        )
+
+    def to_tuple(self):
+        return tuple(getattr(self, field) for field in SONG_FIELDS)
+
+
+def write_catalog(songs, path=song_catalog_file):
+    """
+    Write the compact catalog of the songs.
+
+    :param songs: Songs as written to full_song_data.json.
+    :param path: Where to write the catalog.
+    """
+    catalog = {
+        "version": CATALOG_VERSION,
+        "fields": SONG_FIELDS,
+        # Plain tuples load much faster than pickled objects
+        "songs": [Song.from_dict(item).to_tuple() for item in songs],
+    }
+
+    # The bot never loads a half written catalog
+    with atomic_write(path, "wb") as file:
+        pickle.dump(catalog, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_catalog(data_path=song_data_file, catalog_path=song_catalog_file):
+    """
+    Load the songs, from the compact catalog when it is up to date.
+
+    Falls back to the JSON song data if the catalog is missing, older than the
+    song data or was written for other fields. Without the JSON song data, as on a
+    deployment that only ships the catalog, the catalog is used whatever its age.
+
+    :return: A list of Song.
+    """
+    try:
+        data_mtime = os.path.getmtime(data_path)
+    except FileNotFoundError:
+        data_mtime = None
+
+    try:
+        if data_mtime is None or os.path.getmtime(catalog_path) >= data_mtime:
+            with open(catalog_path, "rb") as file:
+                catalog = pickle.load(file)
+
+            if (
+                catalog.get("version") == CATALOG_VERSION
+                and tuple(catalog.get("fields", ())) == SONG_FIELDS
+            ):
+                return [Song(*song) for song in catalog["songs"]]
+
+            print(f"'{catalog_path}' is outdated, loading '{data_path}' instead.")
+    except FileNotFoundError:
+        pass
+
+    with open(data_path, "r", encoding="utf-8") as f:
+        return [Song.from_dict(item) for item in json.load(f)]
@@ -0,0 +1,140 @@
+import numpy as np
+from answer_matcher import ANSWER_FIELDS
+
+# Length of the character n-grams the index is built from
+NGRAM_SIZE = 3
+
+# Candidates rescored exactly after the vectorized pass, per requested result
+RERANK_FACTOR = 4
+
+
+def get_ngrams(text):
+    """
+    :return: The set of character n-grams of the normalized text, padded so short
+        texts and word starts still produce n-grams.
+    """
+    padded = f" {text} "
+    if len(padded) <= NGRAM_SIZE:
+        return {padded}
+    return {padded[i : i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+class SongIndex:
+    """
+    An n-gram inverted index over the titles, readings, romanizations and aliases
+    of every song, for fuzzy lookups across the whole catalog.
+
+    Each searchable text gets the Dice coefficient of its n-grams with the query,
+    a song scores as its best text.
+
+    :param songs: The list of Song to index.
+    """
+
+    def __init__(self, songs):
+        self.songs = songs
+        self.songs_by_id = {song.songId: song for song in songs}
+
+        # The texts of a song are stored next to each other, starting at its offset
+        texts = []
+        indexed_songs = []
+        text_offsets = []
+        for song_index, song in enumerate(songs):
+            values = [getattr(song, field) for field in ANSWER_FIELDS]
+            values.extend(song.aliases or ())
+
+            song_texts = []
+            for value in values:
+                if not isinstance(value, str):
+                    continue
+                text = normalize(value)
+                if text and text not in song_texts:
+                    song_texts.append(text)
+
+            if song_texts:
+                indexed_songs.append(song_index)
+                text_offsets.append(len(texts))
+                texts.extend(song_texts)
+
+        self.texts = texts
+        self.indexed_songs = np.array(indexed_songs, dtype=np.int32)
+        self.text_offsets = np.array(text_offsets + [len(texts)], dtype=np.int64)
+
+        # Postings of every n-gram, stored as one array sliced by offsets
+        postings = {}
+        text_ngram_counts = np.empty(len(texts), dtype=np.float32)
+        for text_index, text in enumerate(texts):
+            ngrams = get_ngrams(text)
+            text_ngram_counts[text_index] = len(ngrams)
+            for ngram in ngrams:
+                postings.setdefault(ngram, []).append(text_index)
+
+        self.text_ngram_counts = text_ngram_counts
+        self.ngram_ids = {}
+        offsets = [0]
+        for ngram_id, (ngram, text_indexes) in enumerate(postings.items()):
+            self.ngram_ids[ngram] = ngram_id
+            offsets.append(offsets[-1] + len(text_indexes))
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.postings = np.fromiter(
+            (i for text_indexes in postings.values() for i in text_indexes),
+            dtype=np.int32,
+            count=offsets[-1],
+        )
+
+    def get(self, song_id):
+        return self.songs_by_id.get(song_id)
+
+    def search(self, query, limit=10):
+        """
+        Find the songs best matching query.
+
+        :param query: The text to look up.
+        :param limit: The largest number of results.
+        :return: A list of (song, score) sorted by descending score, score is in (0, 1].
+        """
+        query = normalize(query)
+        if not query or not self.texts:
+            return []
+
+        query_ngrams = get_ngrams(query)
+        ngram_ids = [self.ngram_ids[g] for g in query_ngrams if g in self.ngram_ids]
+        if not ngram_ids:
+            return []
+
+        # Count the n-grams every text shares with the query in one pass
+        hits = np.concatenate(
+            [self.postings[self.offsets[i] : self.offsets[i + 1]] for i in ngram_ids]
+        )
+        shared = np.bincount(hits, minlength=len(self.texts))
+        scores = 2.0 * shared / (self.text_ngram_counts + len(query_ngrams))
+
+        # Keep the best text of every song
+        song_scores = np.maximum.reduceat(scores, self.text_offsets[:-1])
+
+        candidate_count = min(limit * RERANK_FACTOR, np.count_nonzero(song_scores))
+        if candidate_count == 0:
+            return []
+        candidates = np.argpartition(-song_scores, candidate_count - 1)[
+            :candidate_count
+        ]
+
+        results = [
+            (self.songs[self.indexed_songs[i]], self.rerank(i, query, song_scores[i]))
+            for i in candidates
+        ]
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:limit]
+
+    def rerank(self, position, query, score):
+        # Exact and prefix matches beat texts that merely share many n-grams
+        start, end = self.text_offsets[position], self.text_offsets[position + 1]
+        for text in self.texts[start:end]:
+            if text == query:
+                return 1.0
+            if text.startswith(query):
+                score = max(score, 0.5 + score / 2)
+        return min(float(score), 1.0)
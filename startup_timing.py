@@ -0,0 +1,46 @@
+from contextlib import contextmanager
+import time
+
+
+class StartupTimer:
+    """
+    Records how long the steps of starting the bot take, for the startup report.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.durations = []
+        self.marks = []
+        self.reported = False
+
+    @contextmanager
+    def measure(self, name):
+        """
+        Measure the duration of the with block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations.append((name, time.perf_counter() - start))
+
+    def mark(self, name):
+        """
+        Record that a point of the startup was reached.
+        """
+        self.marks.append((name, time.perf_counter() - self.start_time))
+
+    def report(self):
+        # Only report the first startup, not every reconnect
+        if self.reported:
+            return
+        self.reported = True
+
+        print("Startup timing:")
+        for name, duration in self.durations:
+            print(f"  {name:<32}{duration * 1000:>10.1f} ms")
+        for name, elapsed in self.marks:
+            print(f"  {name:<32}{elapsed * 1000:>10.1f} ms since start")
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,76 @@
+import difflib
+import math
+import random
+import unittest
+from answer_matcher import AnswerMatcher
+from benchmarks import fixtures
+from song_catalog import Song
+
+
+def get_original_threshold(length):
+    if length < 5:
+        return 0.6
+    elif length > 30:
+        return 0.45
+    return 0.2 * math.exp(-0.1 * (length - 5)) + 0.45
+
+
+def is_correct_original(item, guess):
+    # The check before AnswerMatcher, comparing the guess with every field in full
+    guess = guess.lower()
+
+    values = [
+        item["title"],
+        item.get("reading", ""),
+        item.get("romonizedTitle", ""),
+        item.get("fullRomonizedTitle", ""),
+    ]
+    for value in values:
+        if isinstance(value, str) and len(value) >= 3:
+            similarity = difflib.SequenceMatcher(None, guess, value.lower()).ratio()
+            if similarity > get_original_threshold(len(value)):
+                return True
+
+    for alias in item.get("aliases", []):
+        if len(alias) >= 3:
+            similarity = difflib.SequenceMatcher(None, guess, alias.lower()).ratio()
+            if similarity > get_original_threshold(len(alias)):
+                return True
+
+    return False
+
+
+class AnswerMatcherTest(unittest.TestCase):
+    def assert_same_as_original(self, guesses):
+        matchers = {}
+        for song, guess in guesses:
+            matcher = matchers.get(song["songId"])
+            if matcher is None:
+                matcher = matchers[song["songId"]] = AnswerMatcher(Song.from_dict(song))
+
+            with self.subTest(song=song["title"], guess=guess):
+                self.assertEqual(
+                    matcher.is_correct(guess), is_correct_original(song, guess)
+                )
+
+    def test_guess_corpora(self):
+        songs = fixtures.make_songs(200)
+        for guesses in fixtures.make_guesses(songs, 3000).values():
+            self.assert_same_as_original(guesses)
+
+    def test_guesses_near_the_bounds(self):
+        # Guesses whose length or characters sit around the pre-filter bounds
+        rng = random.Random(1)
+        songs = fixtures.make_songs(100, seed=1)
+        guesses = []
+        for song in songs:
+            title = song["title"]
+            for _ in range(20):
+                guess = fixtures.mutate(title, rng, rng.randint(0, len(title)))
+                cut = rng.randint(0, len(guess))
+                guesses.append((song, rng.choice([guess, guess[:cut], guess * 2])))
+        self.assert_same_as_original(guesses)
+
+
+if __name__ == "__main__":
+    unittest.main()
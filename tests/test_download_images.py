@@ -0,0 +1,225 @@
+import os
+import hashlib
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import download_images
+
+COVERS = {
+    "/ok.jpg": b"ok cover" * 1000,
+    "/flaky.png": b"flaky cover" * 500,
+}
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+def get_etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+
+
+class CoverHandler(BaseHTTPRequestHandler):
+    # Requests per path and the validators they sent, shared by all handler instances
+    requests = {}
+    validators = []
+
+    def do_GET(self):
+        count = CoverHandler.requests.get(self.path, 0) + 1
+        CoverHandler.requests[self.path] = count
+
+        # The flaky cover fails with a server error the first time
+        if self.path == "/flaky.png" and count == 1:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        body = COVERS.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if_none_match = self.headers.get("If-None-Match")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_none_match or if_modified_since:
+            CoverHandler.validators.append(
+                (self.path, if_none_match, if_modified_since)
+            )
+        if if_none_match == get_etag(body):
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", get_etag(body))
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadImagesTest(unittest.TestCase):
+    def setUp(self):
+        CoverHandler.requests = {}
+        CoverHandler.validators = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CoverHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/"
+
+        self.folder = tempfile.mkdtemp()
+        self.images = os.path.join(self.folder, "images")
+        self.manifest = os.path.join(self.folder, "manifest.json")
+
+        # Don't wait between retries
+        self.retry_backoff = download_images.retry_backoff
+        download_images.retry_backoff = 0
+        self.revalidate_after = download_images.revalidate_after
+
+    def tearDown(self):
+        download_images.retry_backoff = self.retry_backoff
+        download_images.revalidate_after = self.revalidate_after
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def download(self, items):
+        return download_images.download_images(
+            items, self.base_url, self.images, 2, self.manifest
+        )
+
+    def test_retries_server_errors(self):
+        with download_images.create_session(1) as session:
+            status, size, entry = download_images.download_image(
+                session, "flaky.png", "song1.png", self.base_url, self.folder
+            )
+
+        self.assertEqual(status, "downloaded")
+        self.assertEqual(size, len(COVERS["/flaky.png"]))
+        self.assertEqual(entry["size"], size)
+        self.assertEqual(CoverHandler.requests["/flaky.png"], 2)
+
+    def test_renames_part_files(self):
+        with download_images.create_session(1) as session:
+            download_images.download_image(
+                session, "ok.jpg", "song0.jpg", self.base_url, self.folder
+            )
+            status, _, _ = download_images.download_image(
+                session, "missing.jpg", "song2.jpg", self.base_url, self.folder
+            )
+
+        self.assertEqual(status, "failed")
+        # Only the complete cover is left, no temporary files
+        self.assertEqual(os.listdir(self.folder), ["song0.jpg"])
+        with open(os.path.join(self.folder, "song0.jpg"), "rb") as file:
+            self.assertEqual(file.read(), COVERS["/ok.jpg"])
+
+    def test_summary(self):
+        items = [
+            {"songId": "song0", "imageName": "ok.jpg"},
+            {"songId": "song1", "imageName": "flaky.png"},
+            {"songId": "song2", "imageName": "missing.jpg"},
+        ]
+
+        summary = self.download(items)
+        self.assertEqual(summary["downloaded"], 2)
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(
+            summary["bytes"], len(COVERS["/ok.jpg"]) + len(COVERS["/flaky.png"])
+        )
+        self.assertEqual(sorted(os.listdir(self.images)), ["song0.jpg", "song1.png"])
+
+        # A second run finds everything up to date
+        summary = self.download(items)
+        self.assertEqual(summary["fresh"], 2)
+        self.assertEqual(summary["downloaded"], 0)
+
+    def test_revalidates_with_validators(self):
+        items = [{"songId": "song0", "imageName": "ok.jpg"}]
+        self.download(items)
+
+        manifest = download_images.load_manifest(self.manifest)
+        self.assertEqual(manifest["song0"]["etag"], get_etag(COVERS["/ok.jpg"]))
+
+        # Once revalidate_after has passed, the cover is only asked for if it changed
+        download_images.revalidate_after = 0
+        summary = self.download(items)
+        self.assertEqual(summary["unchanged"], 1)
+        self.assertEqual(summary["downloaded"], 0)
+        self.assertEqual(summary["bytes"], 0)
+        self.assertEqual(
+            CoverHandler.validators,
+            [("/ok.jpg", get_etag(COVERS["/ok.jpg"]), LAST_MODIFIED)],
+        )
+
+        # The check is recorded, the cover itself is kept
+        self.assertGreater(
+            download_images.load_manifest(self.manifest)["song0"]["checked"],
+            manifest["song0"]["checked"],
+        )
+        with open(os.path.join(self.images, "song0.jpg"), "rb") as file:
+            self.assertEqual(file.read(), COVERS["/ok.jpg"])
+
+    def test_prunes_orphans(self):
+        items = [
+            {"songId": "song0", "imageName": "ok.jpg"},
+            {"songId": "song1", "imageName": "flaky.png"},
+        ]
+        self.download(items)
+
+        # A song that left the catalog, and a file nothing refers to
+        with open(os.path.join(self.images, "stale.jpg"), "wb") as file:
+            file.write(b"stale")
+        summary = self.download(items[:1])
+
+        self.assertEqual(summary["removed"], 2)
+        self.assertEqual(os.listdir(self.images), ["song0.jpg"])
+        self.assertEqual(list(download_images.load_manifest(self.manifest)), ["song0"])
+
+        # An empty song list is treated as broken data, nothing is deleted
+        summary = self.download([])
+        self.assertEqual(summary["removed"], 0)
+        self.assertEqual(os.listdir(self.images), ["song0.jpg"])
+
+    def test_save_errors_fail_the_cover(self):
+        items = [
+            {"songId": "song0", "imageName": "ok.jpg"},
+            {"songId": "song1", "imageName": "flaky.png"},
+        ]
+
+        replace = os.replace
+
+        def replace_covers(source, destination):
+            # Like a full disk, but the manifest is still saved
+            if not destination.endswith(".json"):
+                raise OSError(28, "No space left on device")
+            replace(source, destination)
+
+        # The error must not abort the sync or leave files behind
+        with mock.patch("atomic_file.os.replace", side_effect=replace_covers):
+            summary = self.download(items)
+
+        self.assertEqual(summary["failed"], 2)
+        self.assertEqual(os.listdir(self.images), [])
+
+    def test_adopts_covers_without_entry(self):
+        # Covers left by an older version or a run killed before saving the manifest
+        os.makedirs(self.images)
+        with open(os.path.join(self.images, "song0.jpg"), "wb") as file:
+            file.write(COVERS["/ok.jpg"])
+
+        summary = self.download([{"songId": "song0", "imageName": "ok.jpg"}])
+        self.assertEqual(summary["adopted"], 1)
+        self.assertEqual(summary["downloaded"], 0)
+        self.assertNotIn("/ok.jpg", CoverHandler.requests)
+
+        manifest = download_images.load_manifest(self.manifest)
+        self.assertEqual(manifest["song0"]["size"], len(COVERS["/ok.jpg"]))
+
+
+if __name__ == "__main__":
+    unittest.main()